@@ -0,0 +1,674 @@
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from copy import deepcopy
+from datetime import datetime
+from http import HTTPStatus
+
+import bson
+import flask
+import pytest
+from openapi_schema_validator import validate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import migrations
+import test_endpoints
+import testutil
+
+# Latency and throughput benchmarks for the server's endpoints. Each benchmark class borrows the seeding fixtures of
+# the matching test class in test_endpoints.py, so the data under load is the same data the correctness tests use.
+# This module is not collected by default. Run it explicitly with `pytest bench_endpoints.py`.
+# The results of a run are written as JSON to BENCH_OUTPUT so that releases can be compared against each other.
+
+BENCH_ITERATIONS = int(os.environ.get("BENCH_ITERATIONS", 200))
+BENCH_WARMUP = int(os.environ.get("BENCH_WARMUP", 10))
+BENCH_OUTPUT = os.environ.get("BENCH_OUTPUT", "bench_results.json")
+BENCH_PRESCREEN_ITERATIONS = int(os.environ.get("BENCH_PRESCREEN_ITERATIONS", 3))
+BENCH_BATCH_SIZE = int(os.environ.get("BENCH_BATCH_SIZE", 100))
+BENCH_PROCESS_ITERATIONS = int(os.environ.get("BENCH_PROCESS_ITERATIONS", 3))
+BENCH_LEADERBOARD_USERS = int(os.environ.get("BENCH_LEADERBOARD_USERS", 100000))
+BENCH_SESSION_USERS = int(os.environ.get("BENCH_SESSION_USERS", 5000))
+BENCH_UNREC_QUESTIONS = int(os.environ.get("BENCH_UNREC_QUESTIONS", 100000))
+BENCH_SEGMENT_SENTENCES = int(os.environ.get("BENCH_SEGMENT_SENTENCES", 50))
+BENCH_SEGMENT_RECORDINGS = int(os.environ.get("BENCH_SEGMENT_RECORDINGS", 100))
+BENCH_CATEGORY_QUESTIONS = int(os.environ.get("BENCH_CATEGORY_QUESTIONS", 2000))
+BENCH_PAGE_SIZE = int(os.environ.get("BENCH_PAGE_SIZE", 50))
+# Share of the questions in each category for the skewed category benchmark.
+BENCH_CATEGORY_SHARES = {"mathematics": 0.01, "literature": 0.6, "history": 0.2, "science": 0.19}
+
+
+def measure(request_fn, iterations=BENCH_ITERATIONS, warmup=BENCH_WARMUP):
+    """Call request_fn repeatedly and summarize its latency distribution and throughput."""
+    for _ in range(warmup):
+        request_fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        request_start = time.perf_counter()
+        request_fn()
+        latencies.append(time.perf_counter() - request_start)
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+def summarize(latencies, elapsed):
+    """Get the p50/p95/p99 latencies (in milliseconds) and requests per second of a series of timings."""
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "iterations": len(latencies),
+        "p50": cut_points[49] * 1000,
+        "p95": cut_points[94] * 1000,
+        "p99": cut_points[98] * 1000,
+        "mean": statistics.mean(latencies) * 1000,
+        "rps": len(latencies) / elapsed
+    }
+
+
+def expect_status(response, status=HTTPStatus.OK):
+    assert testutil.match_status(status, response.status)
+    return response
+
+
+# Content encodings to compare in the wire size benchmarks. Brotli is optional on both sides.
+ENCODINGS = ["identity", "gzip", pytest.param("br", marks=pytest.mark.skipif(brotli is None, reason="needs brotli"))]
+
+
+def measure_encoding(client, route, encoding, query_string=None):
+    """Benchmark a GET request that accepts one content encoding. Returns the summary and the size of the body."""
+    headers = {"Accept-Encoding": encoding}
+    response = expect_status(client.get(route, query_string=query_string, headers=headers))
+    identity_response = expect_status(client.get(route, query_string=query_string,
+                                                 headers={"Accept-Encoding": "identity"}))
+    wire_info = {
+        "encoding": response.headers.get("Content-Encoding", "identity"),
+        "bytes": len(response.data),
+        "uncompressedBytes": len(identity_response.data)
+    }
+    summary = measure(lambda: expect_status(client.get(route, query_string=query_string, headers=headers)))
+    return summary, wire_info
+
+
+def measure_serialization(app, documents):
+    """Benchmark serializing documents with the server's JSON encoder, without the rest of a request."""
+    with app.app_context():
+        return measure(lambda: flask.json.dumps(documents))
+
+
+@pytest.fixture(scope="session")
+def bench_results(flask_app):
+    results = []
+    yield results
+    report = {
+        "timestamp": str(datetime.now()),
+        "version": flask_app.config.get("VERSION"),
+        "python": platform.python_version(),
+        "iterations": BENCH_ITERATIONS,
+        "warmup": BENCH_WARMUP,
+        "results": results
+    }
+    with open(BENCH_OUTPUT, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+@pytest.fixture(scope="session")
+def record(bench_results):
+    """Add the summary of a benchmark to the report under the given name."""
+    def record_result(name, summary, **extra):
+        entry = {"name": name, **summary, **extra}
+        bench_results.append(entry)
+        return entry
+    return record_result
+
+
+@pytest.mark.usefixtures("client", "mongodb")
+class TestCheckAnswer:
+    ROUTE = test_endpoints.TestCheckAnswer.ROUTE
+    CORRECT_ANSWER_TYPOS = test_endpoints.TestCheckAnswer.CORRECT_ANSWER_TYPOS
+
+    question_id = test_endpoints.TestCheckAnswer.question_id
+
+    def test_answer(self, client, question_id, record):
+        query_string = {"qid": question_id, "a": self.CORRECT_ANSWER_TYPOS}
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary)
+
+    def test_answer_batch(self, client, question_id, record):
+        arguments = [{"qid": question_id, "a": self.CORRECT_ANSWER_TYPOS}] * BENCH_BATCH_SIZE
+        summary = measure(lambda: expect_status(client.post(self.ROUTE, json={"arguments": arguments})))
+        record(f"POST {self.ROUTE}", summary, batchSize=BENCH_BATCH_SIZE,
+               perCheck=summary["mean"] / BENCH_BATCH_SIZE)
+
+
+@pytest.mark.usefixtures("blob_file", "client")
+class TestGetFile:
+    ROUTE = test_endpoints.TestGetFile.ROUTE
+
+    full_route = test_endpoints.TestGetFile.full_route
+
+    def test_download(self, client, full_route, record):
+        num_bytes = len(client.get(full_route).get_data())
+        summary = measure(lambda: expect_status(client.get(full_route)))
+        record(f"GET {self.ROUTE}/<recType>/<id>", summary, bytes=num_bytes, bytesPerSecond=summary["rps"] * num_bytes)
+
+    @pytest.mark.parametrize("num_bytes", [4096, 65536])
+    def test_download_range(self, client, full_route, num_bytes, record):
+        headers = {"Range": f"bytes=0-{num_bytes - 1}"}
+        summary = measure(lambda: expect_status(client.get(full_route, headers=headers), HTTPStatus.PARTIAL_CONTENT))
+        record(f"GET {self.ROUTE}/<recType>/<id>", summary, case="range", bytes=num_bytes,
+               bytesPerSecond=summary["rps"] * num_bytes)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "api_spec")
+class TestGetLeaderboard:
+    ROUTE = test_endpoints.TestGetLeaderboard.ROUTE
+    NUM_USERS = test_endpoints.TestGetLeaderboard.NUM_USERS
+
+    users = test_endpoints.TestGetLeaderboard.users
+
+    @pytest.mark.parametrize("category", ["all", "literature"])
+    def test_leaderboard(self, client, users, category, record):
+        query_string = {"category": category}
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary, category=category)
+
+    @pytest.fixture
+    def many_users(self, mongodb, api_spec):
+        """Insert BENCH_LEADERBOARD_USERS users with random ratings, in the same shape as TestGetLeaderboard.users."""
+        stub = api_spec.get_schema_stub("User")
+        inserted_ids = []
+        chunk_size = 10000
+        for start in range(0, BENCH_LEADERBOARD_USERS, chunk_size):
+            user_docs = []
+            for i in range(start, min(start + chunk_size, BENCH_LEADERBOARD_USERS)):
+                profile = deepcopy(stub)
+                profile.update({
+                    "_id": testutil.generate_uid(),
+                    "username": f"BenchUser{i}",
+                    "ratings": {
+                        "all": random.randrange(BENCH_LEADERBOARD_USERS),
+                        "literature": random.randrange(BENCH_LEADERBOARD_USERS)
+                    }
+                })
+                user_docs.append(profile)
+            inserted_ids += mongodb.Users.insert_many(user_docs).inserted_ids
+        yield
+        mongodb.Users.delete_many({"_id": {"$in": inserted_ids}})
+
+    @pytest.mark.parametrize("category", ["all", "literature"])
+    def test_leaderboard_scale(self, client, many_users, category, record):
+        query_string = {"category": category}
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary, category=category, users=BENCH_LEADERBOARD_USERS)
+
+    def test_leaderboard_pages(self, client, many_users, record):
+        page_size = 50
+        cursors = [None]
+
+        def next_page():
+            query_string = {"category": "all", "size": page_size}
+            if cursors[-1]:
+                query_string["cursor"] = cursors[-1]
+            response = expect_status(client.get(self.ROUTE, query_string=query_string))
+            cursors.append(response.get_json().get("next"))
+
+        summary = measure(next_page)
+        record(f"GET {self.ROUTE}", summary, case="cursor_pages", pageSize=page_size, users=BENCH_LEADERBOARD_USERS)
+
+    @pytest.mark.parametrize("encoding", ENCODINGS)
+    def test_leaderboard_encoding(self, client, many_users, encoding, record):
+        query_string = {"category": "all", "size": BENCH_PAGE_SIZE}
+        summary, wire_info = measure_encoding(client, self.ROUTE, encoding, query_string)
+        record(f"GET {self.ROUTE}", summary, case="encoding", pageSize=BENCH_PAGE_SIZE, **wire_info)
+
+    def test_leaderboard_serialization(self, flask_app, mongodb, many_users, record):
+        documents = list(mongodb.Users.find(sort=[("ratings.all", -1)], limit=BENCH_PAGE_SIZE))
+        summary = measure_serialization(flask_app, documents)
+        record(f"GET {self.ROUTE}", summary, case="serialization", pageSize=BENCH_PAGE_SIZE)
+
+
+@pytest.mark.usefixtures("mongodb", "client", "flask_app", "clear_caches")
+class TestGetRec:
+    ROUTE = test_endpoints.TestGetRec.ROUTE
+    CACHE_NAME = test_endpoints.TestGetRec.CACHE_NAME
+
+    doc_setup = test_endpoints.TestGetRec.doc_setup
+    doc_setup_segmented = test_endpoints.TestGetRec.doc_setup_segmented
+    schema_validator = test_endpoints.TestGetRec.schema_validator
+
+    def test_whole(self, client, flask_app, doc_setup, record):
+        # Servers without caches have no cache statistics to record.
+        has_cache = testutil.has_route(flask_app, "/stats/cache")
+        before = testutil.get_cache_stats(client, self.CACHE_NAME) if has_cache else None
+        summary = measure(lambda: expect_status(client.get(self.ROUTE)))
+        cache_info = {}
+        if has_cache:
+            after = testutil.get_cache_stats(client, self.CACHE_NAME)
+            cache_info = {
+                "cacheHits": after["hits"] - before["hits"],
+                "cacheMisses": after["misses"] - before["misses"]
+            }
+        record(f"GET {self.ROUTE}", summary, case="whole", **cache_info)
+
+    def test_segmented(self, client, doc_setup_segmented, record):
+        summary = measure(lambda: expect_status(client.get(self.ROUTE)))
+        record(f"GET {self.ROUTE}", summary, case="segmented")
+
+    @pytest.mark.parametrize("compiled", [False, True], ids=["uncompiled", "compiled"])
+    def test_validate_response(self, client, api_spec, doc_setup, schema_validator, compiled, record):
+        response_body = expect_status(client.get(self.ROUTE)).get_json()
+        path, method = api_spec.path_for("pick_game_question")
+
+        def validate_uncompiled():
+            op_content = api_spec.api["paths"][path][method]
+            schema = op_content["responses"][str(int(HTTPStatus.OK))]["content"]["application/json"]["schema"]
+            validate(response_body, api_spec.build_schema(schema))
+
+        if compiled:
+            summary = measure(lambda: schema_validator.validate(response_body))
+        else:
+            summary = measure(validate_uncompiled)
+        record("validate pick_game_question", summary, case="compiled" if compiled else "uncompiled")
+
+    @pytest.fixture
+    def doc_setup_segmented_large(self, mongodb, flask_app):
+        """Insert a question with BENCH_SEGMENT_SENTENCES sentences, each with BENCH_SEGMENT_RECORDINGS recordings."""
+        recordings_per_user = 5
+        user_ids = [testutil.generate_uid() for _ in range(max(BENCH_SEGMENT_RECORDINGS // recordings_per_user, 1))]
+        mongodb.Users.insert_many([{"_id": user_id} for user_id in user_ids])
+        inserted_audio_ids = []
+        question_docs = []
+        for i in range(BENCH_SEGMENT_SENTENCES):
+            audio_docs = []
+            for j in range(BENCH_SEGMENT_RECORDINGS):
+                score = random.random()
+                audio_docs.append({
+                    "_id": testutil.generate_audio_id(),
+                    "sentenceId": i,
+                    "qb_id": 0,
+                    "vtt": "The quick brown fox jumps over the lazy dog.",
+                    "gentleVtt": "This is a dummy VTT.",
+                    "version": flask_app.config["VERSION"],
+                    "score": {"wer": score, "mer": score, "wil": score},
+                    "userId": user_ids[j % len(user_ids)],
+                    "recType": "normal"
+                })
+            question_docs.append({
+                "qb_id": 0,
+                "sentenceId": i,
+                "transcript": str(bson.ObjectId()),
+                "recDifficulty": 0,
+                "answer": "Foo",
+                "category": "unknown",
+                "recordings": [{"id": doc["_id"], "recType": "normal"} for doc in audio_docs]
+            })
+            inserted_audio_ids += mongodb.Audio.insert_many(audio_docs).inserted_ids
+        question_results = mongodb.RecordedQuestions.insert_many(question_docs)
+        yield
+        mongodb.Audio.delete_many({"_id": {"$in": inserted_audio_ids}})
+        mongodb.RecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
+        mongodb.Users.delete_many({"_id": {"$in": user_ids}})
+
+    @pytest.fixture(params=[1, 10], ids=["1x", "10x"])
+    def doc_setup_skewed(self, request, mongodb, flask_app):
+        """Insert questions in the proportions of BENCH_CATEGORY_SHARES, scaled up by the parameter."""
+        num_questions = BENCH_CATEGORY_QUESTIONS * request.param
+        question_docs = []
+        audio_docs = []
+        qb_id = 0
+        for category, share in BENCH_CATEGORY_SHARES.items():
+            for _ in range(max(int(num_questions * share), 1)):
+                audio_id = testutil.generate_audio_id()
+                question_docs.append({
+                    "qb_id": qb_id,
+                    "transcript": str(bson.ObjectId()),
+                    "recDifficulty": 0,
+                    "answer": "Foo",
+                    "category": category,
+                    "recordings": [{"id": audio_id, "recType": "normal"}]
+                })
+                audio_docs.append({
+                    "_id": audio_id,
+                    "qb_id": qb_id,
+                    "vtt": "The quick brown fox jumps over the lazy dog.",
+                    "gentleVtt": "This is a dummy VTT.",
+                    "version": flask_app.config["VERSION"],
+                    "score": {"wer": 1, "mer": 1, "wil": 1},
+                    "userId": testutil.generate_uid(),
+                    "recType": "normal"
+                })
+                qb_id += 1
+        question_results = mongodb.RecordedQuestions.insert_many(question_docs)
+        audio_results = mongodb.Audio.insert_many(audio_docs)
+        yield num_questions
+        mongodb.RecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
+        mongodb.Audio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
+
+    @pytest.mark.parametrize("categories, weights", [
+        (["mathematics"], None),
+        (["literature"], None),
+        (["mathematics", "literature"], [1, 1])
+    ], ids=["rare", "common", "weighted"])
+    def test_categorical_skewed(self, client, doc_setup_skewed, categories, weights, record):
+        query_string = {"category": categories}
+        if weights:
+            query_string["categoryWeight"] = weights
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary, case="categorical_skewed", categories=categories, weights=weights,
+               questions=doc_setup_skewed)
+
+    def test_segmented_large(self, client, doc_setup_segmented_large, record):
+        summary = measure(lambda: expect_status(client.get(self.ROUTE)))
+        record(f"GET {self.ROUTE}", summary, case="segmented_large", sentences=BENCH_SEGMENT_SENTENCES,
+               recordingsPerSentence=BENCH_SEGMENT_RECORDINGS)
+
+    @pytest.mark.parametrize("encoding", ENCODINGS)
+    def test_segmented_large_encoding(self, client, doc_setup_segmented_large, encoding, record):
+        summary, wire_info = measure_encoding(client, self.ROUTE, encoding)
+        record(f"GET {self.ROUTE}", summary, case="encoding", sentences=BENCH_SEGMENT_SENTENCES, **wire_info)
+
+
+@pytest.mark.usefixtures("client", "flask_app", "mongodb")
+class TestGetTranscript:
+    ROUTE = test_endpoints.TestGetTranscript.ROUTE
+    BATCH_SIZE = test_endpoints.TestGetTranscript.BATCH_SIZE
+    NUM_SENTENCES = test_endpoints.TestGetTranscript.NUM_SENTENCES
+
+    difficulty_limits = test_endpoints.TestGetTranscript.difficulty_limits
+    rec_difficulties = test_endpoints.TestGetTranscript.rec_difficulties
+    questions = test_endpoints.TestGetTranscript.questions
+
+    def test_any(self, client, questions, record):
+        summary = measure(lambda: expect_status(client.get(self.ROUTE)))
+        record(f"GET {self.ROUTE}", summary, case="any")
+
+    def test_difficulty_batch(self, client, questions, record):
+        query_string = {"difficultyType": 0, "batchSize": self.BATCH_SIZE}
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary, case="difficulty_batch")
+
+    @pytest.fixture
+    def many_questions(self, mongodb, difficulty_limits):
+        """Insert BENCH_UNREC_QUESTIONS segmented questions spread over every difficulty."""
+        max_difficulty = difficulty_limits[-2] * 2
+        inserted_ids = []
+        chunk_size = 10000
+        for start in range(0, BENCH_UNREC_QUESTIONS, chunk_size):
+            sentence_docs = []
+            for qb_id in range(start, min(start + chunk_size, BENCH_UNREC_QUESTIONS)):
+                difficulty = random.randrange(max_difficulty)
+                for j in range(self.NUM_SENTENCES):
+                    sentence_docs.append({
+                        "qb_id": qb_id,
+                        "sentenceId": j,
+                        "transcript": "Foo",
+                        "recDifficulty": difficulty
+                    })
+            inserted_ids += mongodb.UnrecordedQuestions.insert_many(sentence_docs).inserted_ids
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": inserted_ids}})
+        yield
+        mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": inserted_ids}})
+
+    @pytest.mark.parametrize("difficulty_type", [None, 0, 2])
+    def test_batch_scale(self, client, many_questions, difficulty_type, record):
+        query_string = {"batchSize": self.BATCH_SIZE}
+        if difficulty_type is not None:
+            query_string["difficultyType"] = difficulty_type
+        summary = measure(lambda: expect_status(client.get(self.ROUTE, query_string=query_string)))
+        record(f"GET {self.ROUTE}", summary, case="batch_scale", difficultyType=difficulty_type,
+               questions=BENCH_UNREC_QUESTIONS)
+
+    @pytest.mark.parametrize("encoding", ENCODINGS)
+    def test_batch_encoding(self, client, many_questions, encoding, record):
+        query_string = {"batchSize": self.BATCH_SIZE}
+        summary, wire_info = measure_encoding(client, self.ROUTE, encoding, query_string)
+        record(f"GET {self.ROUTE}", summary, case="encoding", batchSize=self.BATCH_SIZE, **wire_info)
+
+    def test_batch_serialization(self, flask_app, mongodb, many_questions, record):
+        documents = list(mongodb.UnrecordedQuestions.find(limit=self.BATCH_SIZE))
+        summary = measure_serialization(flask_app, documents)
+        record(f"GET {self.ROUTE}", summary, case="serialization", batchSize=self.BATCH_SIZE)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "flask_app")
+class TestHLSGet:
+    ROUTE = test_endpoints.TestHLSGet.ROUTE
+
+    doc_setup = test_endpoints.TestHLSGet.doc_setup
+    full_route_vtt = test_endpoints.TestHLSGet.full_route_vtt
+
+    def test_get_vtt(self, client, doc_setup, full_route_vtt, record):
+        summary = measure(lambda: expect_status(client.get(full_route_vtt)))
+        record(f"GET {self.ROUTE}/vtt/<id>", summary)
+
+    def test_get_vtt_conditional(self, client, doc_setup, full_route_vtt, record):
+        headers = {"If-None-Match": client.get(full_route_vtt).headers["ETag"]}
+        summary = measure(lambda: expect_status(client.get(full_route_vtt, headers=headers), HTTPStatus.NOT_MODIFIED))
+        record(f"GET {self.ROUTE}/vtt/<id>", summary, case="not_modified")
+
+
+@pytest.mark.usefixtures("client", "mongodb", "api_spec", "clear_caches")
+class TestOtherProfile:
+    ROUTE = test_endpoints.TestOtherProfile.ROUTE
+
+    other_profile = test_endpoints.TestOtherProfile.other_profile
+
+    @pytest.mark.parametrize("fields", [None, ["username", "pfp"]], ids=["full", "projected"])
+    def test_get(self, client, other_profile, fields, record):
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        query_string = {"fields": fields} if fields else {}
+        num_bytes = len(expect_status(client.get(full_route, query_string=query_string)).get_data())
+        summary = measure(lambda: expect_status(client.get(full_route, query_string=query_string)))
+        record(f"GET {self.ROUTE}/<username>", summary, case="projected" if fields else "full", bytes=num_bytes)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "api_spec", "dev_uid")
+class TestOwnProfile:
+    ROUTE = test_endpoints.TestOwnProfile.ROUTE
+    RECORDINGS_ROUTE = test_endpoints.TestGetRecordings.ROUTE
+
+    user_profile = test_endpoints.TestOwnProfile.user_profile
+
+    @pytest.fixture(params=["UserRecordings", "recordedAudios"])
+    def layout(self, request):
+        """Get where the recordings of a user are stored: the UserRecordings collection or the unmigrated array."""
+        return request.param
+
+    @pytest.fixture(params=[0, 1000, 10000])
+    def recordings(self, request, mongodb, user_profile, layout):
+        recordings = [{"id": testutil.generate_audio_id(), "recType": "normal"} for _ in range(request.param)]
+        if layout == "recordedAudios":
+            mongodb.Users.update_one({"_id": user_profile["_id"]}, {"$set": {"recordedAudios": recordings}})
+        elif recordings:
+            mongodb.UserRecordings.insert_many([
+                {"userId": user_profile["_id"], **recording} for recording in recordings
+            ])
+        yield request.param
+        mongodb.UserRecordings.delete_many({"userId": user_profile["_id"]})
+        mongodb.Users.update_one({"_id": user_profile["_id"]}, {"$unset": {"recordedAudios": ""}})
+
+    def test_get(self, client, recordings, layout, record):
+        summary = measure(lambda: expect_status(client.get(self.ROUTE)))
+        record(f"GET {self.ROUTE}", summary, recordings=recordings, layout=layout)
+
+    def test_recordings_page(self, client, flask_app, recordings, layout, record):
+        testutil.require_route(flask_app, self.RECORDINGS_ROUTE)
+        if layout != "UserRecordings":
+            pytest.skip(f"{self.RECORDINGS_ROUTE} only reads the UserRecordings collection")
+        query_string = {"size": BENCH_PAGE_SIZE}
+        summary = measure(lambda: expect_status(client.get(self.RECORDINGS_ROUTE, query_string=query_string)))
+        record(f"GET {self.RECORDINGS_ROUTE}", summary, recordings=recordings, pageSize=BENCH_PAGE_SIZE)
+
+
+@pytest.mark.usefixtures("client", "mongodb")
+class TestProcessAudio:
+    ROUTE = test_endpoints.TestProcessAudio.ROUTE
+
+    unrec_question = test_endpoints.TestProcessAudio.unrec_question
+    user = test_endpoints.TestProcessAudio.user
+
+    @pytest.fixture
+    def batch_factory(self, mongodb, unrec_question, user, flask_app):
+        """Get a function that inserts unprocessed audio documents and returns update batches of a given size."""
+        inserted_ids = []
+
+        def make_batches(num_batches, batch_size):
+            audio_docs = []
+            batches = []
+            for _ in range(num_batches):
+                batch = []
+                for _ in range(batch_size):
+                    audio_id = testutil.generate_audio_id()
+                    audio_docs.append({
+                        "_id": audio_id,
+                        "qb_id": unrec_question["qb_id"],
+                        "sentenceId": unrec_question["sentenceId"],
+                        "userId": user["_id"],
+                        "gentleVtt": "Foo",
+                        "recType": "normal",
+                        "version": flask_app.config["VERSION"]
+                    })
+                    batch.append({
+                        "_id": audio_id,
+                        "vtt": "Bar",
+                        "score": {"wer": 1.0, "mer": 1.0, "wil": 1.0},
+                        "transcript": unrec_question["transcript"],
+                        "batchNumber": str(datetime.now()),
+                        "metadata": "detect_num_speakers=False, max_num_speakers=1"
+                    })
+                batches.append(batch)
+            inserted_ids.extend(mongodb.UnprocessedAudio.insert_many(audio_docs).inserted_ids)
+            return batches
+
+        yield make_batches
+        # Processing also records each audio document on its question and its user, which would otherwise pile up
+        # across runs and slow down later measurements.
+        mongodb.UnprocessedAudio.delete_many({"_id": {"$in": inserted_ids}})
+        mongodb.Audio.delete_many({"_id": {"$in": inserted_ids}})
+        mongodb.RecordedQuestions.update_many({"recordings.id": {"$in": inserted_ids}},
+                                              {"$pull": {"recordings": {"id": {"$in": inserted_ids}}}})
+        mongodb.Users.update_many({"recordedAudios.id": {"$in": inserted_ids}},
+                                  {"$pull": {"recordedAudios": {"id": {"$in": inserted_ids}}}})
+        mongodb.UserRecordings.delete_many({"id": {"$in": inserted_ids}})
+
+    @pytest.fixture
+    def update_batches(self, batch_factory):
+        """Insert one unprocessed audio document per request and get the single-item batch for each of them."""
+        return batch_factory(BENCH_ITERATIONS, 1)
+
+    def test_single(self, client, update_batches, record):
+        batches = iter(update_batches)
+
+        def process_next():
+            response = expect_status(client.patch(self.ROUTE, json={"arguments": next(batches)}))
+            assert response.get_json()["successes"] == 1
+
+        summary = measure(process_next, iterations=len(update_batches), warmup=0)
+        record(f"PATCH {self.ROUTE}", summary)
+
+    @pytest.mark.parametrize("batch_size", [100, 1000, 10000])
+    def test_batch(self, client, batch_factory, batch_size, record):
+        batches = iter(batch_factory(BENCH_PROCESS_ITERATIONS, batch_size))
+
+        def process_next():
+            response = expect_status(client.patch(self.ROUTE, json={"arguments": next(batches)}))
+            assert response.get_json()["successes"] == batch_size
+
+        summary = measure(process_next, iterations=BENCH_PROCESS_ITERATIONS, warmup=0)
+        record(f"PATCH {self.ROUTE}", summary, case="batch", batchSize=batch_size,
+               docsPerSecond=summary["rps"] * batch_size)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "socket_server_key")
+class TestProcessGameResults:
+    ROUTE = test_endpoints.TestProcessGameResults.ROUTE
+
+    @pytest.fixture
+    def session_users(self, mongodb):
+        """Insert BENCH_SESSION_USERS users and get the game session arguments for all of them."""
+        user_docs = [
+            {"_id": testutil.generate_uid(), "username": f"BenchPlayer{i}"} for i in range(BENCH_SESSION_USERS)
+        ]
+        results = mongodb.Users.insert_many(user_docs)
+        user_update_args = {}
+        for i, user in enumerate(user_docs):
+            user_update_args[user["username"]] = {
+                "questionStats": {
+                    "played": 10,
+                    "buzzed": 5,
+                    "correct": i % 6,
+                    "cumulativeProgressOnBuzz": {
+                        "percentQuestionRead": 2.5,
+                        "numSentences": 10
+                    }
+                },
+                "finished": i % 2 == 0,
+                "won": i % 4 == 0
+            }
+        yield {"mode": "casual", "category": "literature", "users": user_update_args}
+        mongodb.Users.delete_many({"_id": {"$in": results.inserted_ids}})
+
+    def test_large_session(self, client, session_users, socket_server_key, record):
+        def submit():
+            response = expect_status(client.put(self.ROUTE, json=session_users,
+                                                headers={"Authorization": socket_server_key}))
+            response_body = response.get_json()
+            assert response_body["successful"] == response_body["requested"] == BENCH_SESSION_USERS
+
+        summary = measure(submit, iterations=max(BENCH_ITERATIONS // 10, 2), warmup=1)
+        record(f"PUT {self.ROUTE}", summary, users=BENCH_SESSION_USERS,
+               usersPerSecond=summary["rps"] * BENCH_SESSION_USERS)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "bucket", "input_dir", "dev_uid")
+class TestUploadRec:
+    ROUTE = test_endpoints.TestUploadRec.ROUTE
+    CONTENT_TYPE = test_endpoints.TestUploadRec.CONTENT_TYPE
+    DEFAULT_QID = test_endpoints.TestUploadRec.DEFAULT_QID
+    LONG_POLL_WAIT = test_endpoints.TestUploadRec.LONG_POLL_WAIT
+
+    user_id = test_endpoints.TestUploadRec.user_id
+    upload_cleanup = test_endpoints.TestUploadRec.upload_cleanup
+    unrec_sentence_ids = test_endpoints.TestUploadRec.unrec_sentence_ids
+    get_segmented_data = test_endpoints.TestUploadRec.get_segmented_data
+    await_result = test_endpoints.TestUploadRec.await_result
+
+    def test_buzz(self, client, input_dir, upload_cleanup, user_id, record):
+        with open(os.path.join(input_dir, "buzz.wav"), "rb") as f:
+            audio = f.read()
+
+        def upload():
+            data = {"audio": (io.BytesIO(audio), "buzz.wav"), "recType": "buzz"}
+            expect_status(client.post(self.ROUTE, data=data, content_type=self.CONTENT_TYPE), HTTPStatus.ACCEPTED)
+
+        summary = measure(upload)
+        record(f"POST {self.ROUTE}", summary, recType="buzz", bytes=len(audio))
+
+    # Time from submitting the segmented recording until every file has been pre-screened, with the files handled one
+    # after another and then spread over the configured number of workers.
+    @pytest.mark.parametrize("workers", [1, testutil.PRESCREEN_WORKERS], ids=["serial", "parallel"])
+    def test_segmented_prescreen(self, app_factory, input_dir, unrec_sentence_ids, upload_cleanup, user_id, workers,
+                                 record):
+        app = app_factory(PRESCREEN_WORKERS=workers)
+        with app.test_client() as client:
+            def upload_and_wait():
+                data = self.get_segmented_data(input_dir, unrec_sentence_ids, "exact")
+                try:
+                    response = expect_status(client.post(self.ROUTE, data=data, content_type=self.CONTENT_TYPE),
+                                             HTTPStatus.ACCEPTED)
+                    for pointer in response.get_json()["prescreenPointers"]:
+                        self.await_result(client, pointer)
+                finally:
+                    for f in data["audio"]:
+                        f.close()
+
+            summary = measure(upload_and_wait, iterations=BENCH_PRESCREEN_ITERATIONS, warmup=1)
+        record(f"POST {self.ROUTE} until pre-screened", summary, workers=workers,
+               files=len(unrec_sentence_ids))
@@ -0,0 +1,137 @@
+import mmap
+import os
+import shutil
+from tempfile import NamedTemporaryFile
+
+from google.api_core.exceptions import NotFound
+
+# Storage backends for audio blobs. A backend is any object with the subset of the google.cloud.storage.Bucket
+# interface used by the server and the fixtures: bucket.blob(name) returns an object with upload_from_filename(),
+# upload_from_file(), upload_from_string(), download_as_bytes(), download_to_file(), exists(), and delete().
+# The Firebase bucket (firebase_admin.storage.bucket()) is one backend. LocalBucket is the other.
+# Select the backend the tests use by setting the BLOB_BACKEND environment variable to "firebase" or "local".
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_path(blob_root, rec_type, blob_id):
+    """Get the name of the blob of a recording, which is shared by every backend."""
+    return "/".join([blob_root, rec_type, blob_id])
+
+
+class LocalBucket:
+    """A bucket that keeps each blob as a file under a root directory, using the blob name as its relative path."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.name = self.root
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=""):
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                name = os.path.relpath(os.path.join(dir_path, file_name), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    yield self.blob(name)
+
+    def path_for(self, blob_name):
+        """Get the path of the file of a blob, making sure that it stays inside the root directory."""
+        path = os.path.abspath(os.path.join(self.root, *blob_name.split("/")))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Blob name escapes the bucket: '{blob_name}'")
+        return path
+
+
+class LocalBlob:
+    """A blob of a LocalBucket. Reads are served from a memory map of the file."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = bucket.path_for(name)
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, "rb") as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def upload_from_file(self, file_obj, rewind=False, content_type=None):
+        """Copy a file object into the blob in chunks. The blob is replaced atomically once the copy is complete."""
+        if rewind:
+            file_obj.seek(0)
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            try:
+                shutil.copyfileobj(file_obj, tmp, CHUNK_SIZE)
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, self.path)
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, self.path)
+
+    def open_mmap(self):
+        """Memory-map the file of the blob for reading. Returns None for an empty blob, which cannot be mapped."""
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise NotFound(f"No such object: {self.name}")
+
+    def download_as_bytes(self, start=None, end=None):
+        """Get the contents of the blob. As in google.cloud.storage, end is inclusive."""
+        mapped = self.open_mmap()
+        if mapped is None:
+            return b''
+        with mapped:
+            stop = end + 1 if end is not None else None
+            return mapped[start:stop]
+
+    def download_to_file(self, file_obj, start=None, end=None):
+        mapped = self.open_mmap()
+        if mapped is None:
+            return
+        with mapped:
+            stop = end + 1 if end is not None else len(mapped)
+            view = memoryview(mapped)
+            try:
+                for offset in range(start or 0, stop, CHUNK_SIZE):
+                    file_obj.write(view[offset:min(offset + CHUNK_SIZE, stop)])
+            finally:
+                view.release()
+
+    def download_to_filename(self, filename, start=None, end=None):
+        with open(filename, "wb") as f:
+            self.download_to_file(f, start=start, end=end)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise NotFound(f"No such object: {self.name}")
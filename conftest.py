@@ -1,5 +1,6 @@
 import os
 import secrets
+from http import HTTPStatus
 from shutil import rmtree
 from tempfile import mkdtemp
 
@@ -7,6 +8,9 @@ import pymongo
 import pytest
 from firebase_admin import storage
 
+import blobstorage
+import memorydb
+import testutil
 from server import create_app
 from sv_api import QuizzrAPISpec
 
@@ -44,6 +48,11 @@ def api_spec(qs_dir):
     return QuizzrAPISpec(os.path.join(qs_dir, "reference", "backend.yaml"))
 
 
+@pytest.fixture(scope="session")
+def validators(api_spec):
+    return testutil.ValidatorRegistry(api_spec)
+
+
 @pytest.fixture(scope="session")
 def client(flask_app):
     with flask_app.test_client() as client:
@@ -52,10 +61,39 @@ def client(flask_app):
 
 @pytest.fixture(scope="session")
 def mongodb_client():
+    if testutil.MONGODB_BACKEND == "memory":
+        return memorydb.MemoryClient()
     connection_string = os.environ["CONNECTION_STRING"]
     return pymongo.MongoClient(connection_string)
 
 
+@pytest.fixture(scope="session")
+def command_recorder():
+    return testutil.CommandRecorder()
+
+
+@pytest.fixture(scope="session")
+def recorded_client(app_factory, command_recorder):
+    """Get a client of a server whose commands to MongoDB are kept by the command recorder."""
+    if testutil.MONGODB_BACKEND == "memory":
+        pytest.skip("The in-memory backend does not report the commands that it receives")
+    mongodb_client = pymongo.MongoClient(os.environ["CONNECTION_STRING"], event_listeners=[command_recorder])
+    with app_factory(test_mongodb_client=mongodb_client).test_client() as client:
+        return client
+
+
+@pytest.fixture
+def clear_caches(client, flask_app):
+    """
+    Empty the server's in-process caches, which cannot see documents that fixtures write straight to the database. Does
+    nothing if the server has no caches.
+    """
+    if not testutil.has_route(flask_app, "/stats/cache", "DELETE"):
+        return
+    response = client.delete("/stats/cache")
+    assert response.status_code == HTTPStatus.OK
+
+
 @pytest.fixture(scope="session")
 def socket_server_key(client):
     response = client.post("/socket/key")
@@ -64,34 +102,56 @@ def socket_server_key(client):
 
 
 @pytest.fixture(scope="session")
-def flask_app(blob_root_name, db_name, dev_uid):
-    storage_dir = mkdtemp()
-    app = create_app({
-        "Q_ENV": "testing",
-        "DATABASE": db_name,
-        "BLOB_ROOT": blob_root_name,
-        "DIFFICULTY_LIMITS": DIFFICULTY_LIMITS,
-        "DEV_UID": dev_uid,
-        "TESTING": True,
-        "USE_ID_TOKENS": False
-    }, test_storage_root=storage_dir)
-    yield app
-    rmtree(storage_dir)
+def storage_dir():
+    path = mkdtemp()
+    yield path
+    rmtree(path)
+
+
+@pytest.fixture(scope="session")
+def app_factory(blob_root_name, db_name, dev_uid, mongodb_client, storage_dir):
+    """Get a function that creates a server with the test configuration, updated with the given configuration."""
+    def make_app(test_mongodb_client=None, **config):
+        app_kwargs = {"test_storage_root": storage_dir}
+        if test_mongodb_client is not None:
+            app_kwargs["test_mongodb_client"] = test_mongodb_client
+        elif testutil.MONGODB_BACKEND == "memory":
+            app_kwargs["test_mongodb_client"] = mongodb_client
+        if testutil.BLOB_BACKEND == "local":
+            app_kwargs["test_bucket"] = blobstorage.LocalBucket(storage_dir)
+        return create_app({
+            "Q_ENV": "testing",
+            "DATABASE": db_name,
+            "BLOB_ROOT": blob_root_name,
+            "DIFFICULTY_LIMITS": DIFFICULTY_LIMITS,
+            "DEV_UID": dev_uid,
+            "PRESCREEN_WORKERS": testutil.PRESCREEN_WORKERS,
+            "TESTING": True,
+            "USE_ID_TOKENS": False,
+            **config
+        }, **app_kwargs)
+    return make_app
+
+
+@pytest.fixture(scope="session")
+def flask_app(app_factory):
+    return app_factory()
 
 
 @pytest.fixture(scope="session")
-def firebase_bucket(flask_app):
+def bucket(flask_app, storage_dir):
+    if testutil.BLOB_BACKEND == "local":
+        return blobstorage.LocalBucket(storage_dir)
     return storage.bucket()
 
 
 @pytest.fixture(scope="session")
-def blob_file(firebase_bucket, flask_app, input_dir):
+def blob_file(bucket, flask_app, input_dir):
     file_name = "test.wav"
     file_path = os.path.join(input_dir, file_name)
 
     blob_name = secrets.token_urlsafe(nbytes=32)
-    blob_path = "/".join([flask_app.config["BLOB_ROOT"], "normal", blob_name])
-    blob = firebase_bucket.blob(blob_path)
+    blob = bucket.blob(blobstorage.blob_path(flask_app.config["BLOB_ROOT"], "normal", blob_name))
     blob.upload_from_filename(file_path)
     yield blob_name
     blob.delete()
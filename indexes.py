@@ -0,0 +1,46 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+# Declarative specification of the indexes of each collection, keyed by collection name. create_app applies it on
+# startup through apply_indexes(). test_indexes.py checks that a server started against an empty database creates these
+# indexes and that the server's queries use them.
+
+# Categories that have their own leaderboard, and therefore their own index on ratings.<category>.
+CATEGORIES = ["all", "literature", "history", "mathematics", "science"]
+
+INDEXES = {
+    "Audio": [
+        IndexModel([("qb_id", ASCENDING), ("sentenceId", ASCENDING)]),
+        IndexModel([("userId", ASCENDING)])
+    ],
+    "RecordedQuestions": [
+        IndexModel([("qb_id", ASCENDING), ("sentenceId", ASCENDING)]),
+        IndexModel([("category", ASCENDING)]),
+        IndexModel([("recordings.id", ASCENDING)])
+    ],
+    "UnrecordedQuestions": [
+        IndexModel([("qb_id", ASCENDING), ("sentenceId", ASCENDING)]),
+        IndexModel([("difficultyType", ASCENDING), ("qb_id", ASCENDING)])
+    ],
+    "UnprocessedAudio": [
+        IndexModel([("qb_id", ASCENDING), ("sentenceId", ASCENDING)]),
+        IndexModel([("userId", ASCENDING)])
+    ],
+    "UserRecordings": [
+        IndexModel([("userId", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("userId", ASCENDING), ("id", ASCENDING)], unique=True)
+    ],
+    "Votes": [
+        IndexModel([("userId", ASCENDING), ("audioId", ASCENDING)], unique=True),
+        IndexModel([("audioId", ASCENDING)])
+    ],
+    "Users": [
+        IndexModel([("username", ASCENDING)]),
+        *[IndexModel([(f"ratings.{category}", DESCENDING)]) for category in CATEGORIES]
+    ]
+}
+
+
+def apply_indexes(database, spec=None):
+    """Create every index in a specification. Existing indexes with the same options are left alone."""
+    for collection_name, models in (spec or INDEXES).items():
+        database.get_collection(collection_name).create_indexes(models)
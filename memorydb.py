@@ -0,0 +1,1378 @@
+import random
+import re
+import threading
+from copy import deepcopy
+from datetime import datetime, timezone
+
+import bson
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# An in-process stand-in for the subset of pymongo that the server and the fixtures use. Select it by setting the
+# MONGODB_BACKEND environment variable to "memory". Documents are stored as they would come back from a BSON round
+# trip, so datetimes lose their time zone and their microseconds, tuples become lists, and keys must be strings, just
+# like with a real database. They are deep-copied on the way out, so callers can never alias the stored data.
+
+_MISSING = object()
+
+# Order of BSON types when sorting and comparing values of different types.
+_TYPE_ORDER = [
+    (type(None), 1),
+    (bool, 8),
+    (int, 2),
+    (float, 2),
+    (str, 3),
+    (dict, 4),
+    (list, 5),
+    (bytes, 6),
+    (bson.ObjectId, 7),
+    (datetime, 9)
+]
+
+
+class MemoryClient:
+    """Stand-in for pymongo.MongoClient that keeps every database in memory."""
+
+    def __init__(self):
+        self._databases = {}
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.RLock()
+
+    def get_database(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = MemoryDatabase(self, name)
+            return self._databases[name]
+
+    def __getitem__(self, name):
+        return self.get_database(name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_database(name)
+
+    def list_database_names(self):
+        return list(self._databases.keys())
+
+    def drop_database(self, name):
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def start_session(self, **kwargs):
+        return MemorySession(self)
+
+    def close(self):
+        pass
+
+
+class MemorySession:
+    """
+    Stand-in for pymongo.client_session.ClientSession. Transactions run one at a time. Writes that are given the session
+    while its transaction is in progress are journaled, and aborting the transaction undoes them in reverse order. A
+    document that was written outside of the transaction since is left alone, and collections that were created during
+    the transaction are dropped if they are empty afterwards. Writes made outside of a transaction are not isolated.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._undo = None
+        self._collections_before = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_session()
+
+    @property
+    def in_transaction(self):
+        return self._undo is not None
+
+    def start_transaction(self, **kwargs):
+        if self.in_transaction:
+            raise OperationFailure("Transaction already in progress")
+        self.client._transaction_lock.acquire()
+        self._undo = []
+        self._collections_before = set(self._collections())
+        return _MemoryTransaction(self)
+
+    def commit_transaction(self):
+        if not self.in_transaction:
+            raise OperationFailure("No transaction started")
+        self._end_transaction()
+
+    def abort_transaction(self):
+        if not self.in_transaction:
+            raise OperationFailure("No transaction started")
+        for undo in reversed(self._undo):
+            undo()
+        for database, collection in self._collections():
+            if (database, collection) not in self._collections_before \
+                    and not collection._docs and not collection._indexes:
+                database.drop_collection(collection.name)
+        self._end_transaction()
+
+    def with_transaction(self, callback, **kwargs):
+        with self.start_transaction():
+            return callback(self)
+
+    def end_session(self):
+        if self.in_transaction:
+            self.abort_transaction()
+
+    def _journal(self, undo):
+        """Keep a function that undoes a write made in the transaction."""
+        self._undo.append(undo)
+
+    def _collections(self):
+        return [
+            (database, collection)
+            for database in list(self.client._databases.values())
+            for collection in list(database._collections.values())
+        ]
+
+    def _end_transaction(self):
+        self._undo = None
+        self._collections_before = None
+        self.client._transaction_lock.release()
+
+
+class _MemoryTransaction:
+    """Context manager returned by MemorySession.start_transaction(). Commits on success and aborts on an error."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.session.in_transaction:
+            return
+        if exc_type is None:
+            self.session.commit_transaction()
+        else:
+            self.session.abort_transaction()
+
+
+class MemoryDatabase:
+    """Stand-in for pymongo.database.Database."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def list_collection_names(self):
+        return list(self._collections.keys())
+
+    def drop_collection(self, name):
+        with self._lock:
+            self._collections.pop(name, None)
+
+
+class MemoryCollection:
+    """Stand-in for pymongo.collection.Collection. Documents are kept in insertion order, keyed by _id."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = {}
+        self._indexes = {}
+        self._unique_keys = {}  # Index name -> key of each document in a unique index -> document ID
+        self._lock = threading.RLock()
+
+    @property
+    def full_name(self):
+        return f"{self.database.name}.{self.name}"
+
+    # Writes
+
+    def insert_one(self, document, session=None, **kwargs):
+        with self._lock:
+            inserted_id = self._insert(document, session)
+        return InsertOneResult(inserted_id, True)
+
+    def insert_many(self, documents, ordered=True, session=None, **kwargs):
+        """Insert documents as a bulk write, so that a duplicate key raises BulkWriteError as in pymongo."""
+        documents = list(documents)
+        for document in documents:
+            document.setdefault("_id", bson.ObjectId())  # pymongo adds every ID before sending any document.
+        self.bulk_write([InsertOne(document) for document in documents], ordered=ordered, session=session)
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+    def delete_one(self, filter, session=None, **kwargs):
+        with self._lock:
+            for doc_id in self._matching_ids(filter, limit=1):
+                self._remove(doc_id, session)
+                return DeleteResult({"n": 1}, True)
+        return DeleteResult({"n": 0}, True)
+
+    def delete_many(self, filter, session=None, **kwargs):
+        with self._lock:
+            doc_ids = self._matching_ids(filter)
+            for doc_id in doc_ids:
+                self._remove(doc_id, session)
+        return DeleteResult({"n": len(doc_ids)}, True)
+
+    def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        with self._lock:
+            return self._update(filter, update, upsert, multi=False, session=session)
+
+    def update_many(self, filter, update, upsert=False, session=None, **kwargs):
+        with self._lock:
+            return self._update(filter, update, upsert, multi=True, session=session)
+
+    def replace_one(self, filter, replacement, upsert=False, session=None, **kwargs):
+        with self._lock:
+            for doc_id in self._matching_ids(filter, limit=1):
+                new_doc = _to_bson(replacement)
+                new_doc["_id"] = self._docs[doc_id]["_id"]
+                self._replace(doc_id, new_doc, session)
+                return UpdateResult({"n": 1, "nModified": 1}, True)
+            if upsert:
+                new_doc = deepcopy(replacement)
+                new_doc.setdefault("_id", _equality_fields(filter).get("_id", bson.ObjectId()))
+                doc_id = self._insert(new_doc, session)
+                return UpdateResult({"n": 0, "nModified": 0, "upserted": doc_id}, True)
+            return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        with self._lock:
+            doc_ids = self._matching_ids(filter, sort=sort, limit=1)
+            if not doc_ids:
+                if not upsert:
+                    return None
+                result = self._update(filter, update, upsert=True, multi=False, session=session)
+                if return_document == ReturnDocument.BEFORE:
+                    return None
+                return _project(self._docs[_hashable(result.upserted_id)], projection)
+            doc_id = doc_ids[0]
+            before = deepcopy(self._docs[doc_id])
+            self._apply_update(doc_id, filter, update, session)
+            if return_document == ReturnDocument.BEFORE:
+                return _project(before, projection)
+            return _project(self._docs[doc_id], projection)
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, session=None, **kwargs):
+        with self._lock:
+            for doc_id in self._matching_ids(filter, sort=sort, limit=1):
+                return _project(self._remove(doc_id, session), projection)
+        return None
+
+    def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        """Apply a list of write operations. Unordered writes keep going after an error, as in MongoDB."""
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+                  "writeErrors": [], "writeConcernErrors": []}
+        with self._lock:
+            for index, request in enumerate(requests):
+                try:
+                    self._bulk_apply(request, index, result, session)
+                except OperationFailure as e:
+                    result["writeErrors"].append({"index": index, "code": e.code, "errmsg": str(e),
+                                                  "op": getattr(request, "_doc", None)})
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _bulk_apply(self, request, index, result, session):
+        if isinstance(request, InsertOne):
+            self._insert(request._doc, session)
+            result["nInserted"] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany)):
+            update_result = self._update(request._filter, request._doc, request._upsert,
+                                         multi=isinstance(request, UpdateMany), session=session)
+            self._count_update(update_result, index, result)
+        elif isinstance(request, ReplaceOne):
+            update_result = self.replace_one(request._filter, request._doc, request._upsert, session=session)
+            self._count_update(update_result, index, result)
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            doc_ids = self._matching_ids(request._filter, limit=0 if isinstance(request, DeleteMany) else 1)
+            for doc_id in doc_ids:
+                self._remove(doc_id, session)
+            result["nRemoved"] += len(doc_ids)
+        else:
+            raise TypeError(f"{request!r} is not a valid request")
+
+    @staticmethod
+    def _count_update(update_result, index, result):
+        result["nMatched"] += update_result.matched_count
+        result["nModified"] += update_result.modified_count
+        if update_result.upserted_id is not None:
+            result["nUpserted"] += 1
+            result["upserted"].append({"index": index, "_id": update_result.upserted_id})
+
+    # Indexes. Their specifications are kept for explain() and for enforcing unique constraints.
+
+    def create_index(self, keys, name=None, unique=False, session=None, **kwargs):
+        key = _sort_spec(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in key)
+        options = {k: v for k, v in kwargs.items() if k in ("sparse", "partialFilterExpression", "expireAfterSeconds")}
+        index = {"key": key, "fields": [field for field, _ in key], "unique": unique, **options}
+        with self._lock:
+            existing = self._indexes.get(name)
+            if existing is not None:
+                if existing != index:
+                    raise OperationFailure(f"Index with name: {name} already exists with different options", 85)
+                return name
+            self._indexes[name] = index
+            if unique:
+                unique_keys = {}
+                for doc_id, doc in self._docs.items():
+                    index_key = _index_key(doc, index)
+                    if index_key is not None:
+                        if index_key in unique_keys:
+                            del self._indexes[name]
+                            raise _duplicate_key_error(self.full_name, name, dict(zip(index["fields"], index_key)))
+                        unique_keys[index_key] = doc_id
+                self._unique_keys[name] = unique_keys
+            if session is not None and session.in_transaction:
+                session._journal(lambda: self._forget_index(name))
+        return name
+
+    def create_indexes(self, indexes, session=None, **kwargs):
+        names = []
+        for model in indexes:
+            document = dict(model.document)
+            keys = list(document.pop("key").items())
+            names.append(self.create_index(keys, session=session, **document))
+        return names
+
+    def drop_index(self, index_or_name, session=None, **kwargs):
+        _check_not_in_transaction(session, "dropIndexes")
+        name = index_or_name
+        if not isinstance(name, str):
+            name = "_".join(f"{field}_{direction}" for field, direction in _sort_spec(index_or_name))
+        with self._lock:
+            if name not in self._indexes:
+                raise OperationFailure(f"index not found with name [{name}]", 27)
+            self._forget_index(name)
+
+    def drop_indexes(self, session=None, **kwargs):
+        _check_not_in_transaction(session, "dropIndexes")
+        with self._lock:
+            self._indexes.clear()
+            self._unique_keys.clear()
+
+    def index_information(self):
+        information = {"_id_": {"v": 2, "key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            entry = {"v": 2, "key": list(index["key"])}
+            entry.update({k: v for k, v in index.items() if k not in ("key", "fields") and v})
+            information[name] = entry
+        return information
+
+    def list_indexes(self, **kwargs):
+        return iter([{"name": name, **entry} for name, entry in self.index_information().items()])
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+    # Reads
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, *, sort=None, **kwargs):
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection, *args, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter, **kwargs):
+        with self._lock:
+            return len(self._matching_ids(filter))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self._docs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        values = []
+        with self._lock:
+            for doc_id in self._matching_ids(filter):
+                for value in _expand(_get_values(self._docs[doc_id], key)):
+                    if value not in values:
+                        values.append(deepcopy(value))
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        with self._lock:
+            docs = [deepcopy(doc) for doc in self._docs.values()]
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            if operator not in _STAGES:
+                raise OperationFailure(f"Unrecognized pipeline stage name: '{operator}'", 40324)
+            docs = _STAGES[operator](self.database, docs, spec)
+        return iter(docs)
+
+    # Internals. The caller must hold the lock.
+
+    def _insert(self, document, session=None):
+        if "_id" not in document:
+            document["_id"] = bson.ObjectId()  # pymongo also adds the generated ID to the caller's document.
+        doc_id = document["_id"]
+        key = _hashable(doc_id)
+        if key in self._docs:
+            raise _duplicate_key_error(self.full_name, "_id_", {"_id": doc_id})
+        doc = _to_bson(document)
+        self._check_unique(key, doc)
+        self._docs[key] = doc
+        self._add_unique_keys(key, doc)
+        self._journal(session, key, _MISSING, doc)
+        return doc_id
+
+    def _remove(self, doc_id, session=None):
+        doc = self._docs.pop(doc_id)
+        self._remove_unique_keys(doc)
+        self._journal(session, doc_id, doc, _MISSING)
+        return doc
+
+    def _replace(self, doc_id, new_doc, session=None):
+        old_doc = self._docs[doc_id]
+        self._check_unique(doc_id, new_doc)
+        self._remove_unique_keys(old_doc)
+        self._docs[doc_id] = new_doc
+        self._add_unique_keys(doc_id, new_doc)
+        self._journal(session, doc_id, old_doc, new_doc)
+
+    def _journal(self, session, doc_id, before, after):
+        if session is not None and session.in_transaction:
+            session._journal(lambda: self._restore(doc_id, before, after))
+
+    def _restore(self, doc_id, before, after):
+        """Undo a write made in a transaction, unless the document has been written again since."""
+        with self._lock:
+            if self._docs.get(doc_id, _MISSING) is not after:
+                return
+            if after is not _MISSING:
+                self._remove_unique_keys(after)
+            if before is _MISSING:
+                del self._docs[doc_id]
+            else:
+                self._docs[doc_id] = before
+                self._add_unique_keys(doc_id, before)
+
+    def _forget_index(self, name):
+        with self._lock:
+            self._indexes.pop(name, None)
+            self._unique_keys.pop(name, None)
+
+    def _matching_ids(self, filter, sort=None, limit=0):
+        filter = filter or {}
+        if "_id" in filter and not isinstance(filter["_id"], dict):
+            key = _hashable(filter["_id"])
+            doc = self._docs.get(key)
+            return [key] if doc is not None and match(doc, filter) else []
+        doc_ids = []
+        if sort:
+            items = _sort_docs(list(self._docs.items()), sort, key=lambda item: item[1])
+        else:
+            items = self._docs.items()
+        for doc_id, doc in items:
+            if match(doc, filter):
+                doc_ids.append(doc_id)
+                if limit and len(doc_ids) >= limit:
+                    break
+        return doc_ids
+
+    def _update(self, filter, update, upsert, multi, session=None):
+        doc_ids = self._matching_ids(filter, limit=0 if multi else 1)
+        modified = 0
+        for doc_id in doc_ids:
+            if self._apply_update(doc_id, filter, update, session):
+                modified += 1
+        if doc_ids or not upsert:
+            return UpdateResult({"n": len(doc_ids), "nModified": modified}, True)
+
+        new_doc = deepcopy(_equality_fields(filter))
+        apply_update(new_doc, update, filter, inserting=True)
+        doc_id = self._insert(new_doc, session)
+        return UpdateResult({"n": 0, "nModified": 0, "upserted": doc_id}, True)
+
+    def _apply_update(self, doc_id, filter, update, session=None):
+        before = self._docs[doc_id]
+        doc = deepcopy(before)
+        apply_update(doc, update, filter)
+        doc = _to_bson(doc)
+        if doc == before:
+            return False
+        self._replace(doc_id, doc, session)
+        return True
+
+    def _check_unique(self, doc_id, doc):
+        for name, keys in self._unique_keys.items():
+            index_key = _index_key(doc, self._indexes[name])
+            if index_key is not None and keys.get(index_key, doc_id) != doc_id:
+                raise _duplicate_key_error(self.full_name, name, dict(zip(self._indexes[name]["fields"], index_key)))
+
+    def _add_unique_keys(self, doc_id, doc):
+        for name, keys in self._unique_keys.items():
+            index_key = _index_key(doc, self._indexes[name])
+            if index_key is not None:
+                keys[index_key] = doc_id
+
+    def _remove_unique_keys(self, doc):
+        for name, keys in self._unique_keys.items():
+            index_key = _index_key(doc, self._indexes[name])
+            if index_key is not None:
+                keys.pop(index_key, None)
+
+    def _plan(self, filter, sort=None, limit=0):
+        """Choose a query plan the way the MongoDB query planner would, for the output of explain()."""
+        filter = filter or {}
+        if "_id" in filter and not isinstance(filter["_id"], dict):
+            return {"stage": "IDHACK"}
+        fields = _indexable_fields(filter)
+        sort_fields = [field for field, _ in _sort_spec(sort)] if sort else []
+        best_index, best_score = None, 0
+        for name, index in self.index_information().items():
+            index_fields = [field for field, _ in index["key"]]
+            score = 0
+            for field in index_fields:
+                if field not in fields:
+                    break
+                score += 1
+            if not score and sort_fields and index_fields[0] == sort_fields[0]:
+                score = 1
+            if score > best_score:
+                best_index, best_score = (name, index), score
+        if best_index is None:
+            plan = {"stage": "COLLSCAN", "filter": filter, "direction": "forward"}
+            if sort:
+                plan = {"stage": "SORT", "sortPattern": dict(_sort_spec(sort)), "inputStage": plan}
+        else:
+            name, index = best_index
+            plan = {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "keyPattern": dict(index["key"]), "indexName": name}
+            }
+        if limit:
+            plan = {"stage": "LIMIT", "limitAmount": limit, "inputStage": plan}
+        return plan
+
+
+class MemoryCursor:
+    """Stand-in for pymongo.cursor.Cursor. The query is evaluated on the first iteration."""
+
+    def __init__(self, collection, filter, projection):
+        self.collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction)]
+        self._sort = list(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def explain(self):
+        collection = self.collection
+        with collection._lock:
+            plan = collection._plan(self._filter, sort=self._sort, limit=self._limit)
+        return {
+            "queryPlanner": {
+                "namespace": collection.full_name,
+                "parsedQuery": deepcopy(self._filter),
+                "winningPlan": plan,
+                "rejectedPlans": []
+            },
+            "ok": 1.0
+        }
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            self._results = iter(self._evaluate())
+        return next(self._results)
+
+    def _evaluate(self):
+        collection = self.collection
+        with collection._lock:
+            limit = self._limit + self._skip if self._limit else 0
+            doc_ids = collection._matching_ids(self._filter, sort=self._sort, limit=limit)
+            docs = [collection._docs[doc_id] for doc_id in doc_ids[self._skip:]]
+            return [_project(doc, self._projection) for doc in docs]
+
+
+# Queries
+
+
+def match(doc, query):
+    """Check if a document satisfies a query filter."""
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(match(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$or":
+            if not any(match(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$nor":
+            if any(match(doc, sub_query) for sub_query in condition):
+                return False
+        elif not _match_values(_get_values(doc, key), condition):
+            return False
+    return True
+
+
+def _match_values(values, condition):
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_match_operator(values, operator, operand) for operator, operand in condition.items())
+    return _match_equal(values, condition)
+
+
+def _match_equal(values, operand):
+    if operand is None and not values:
+        return True
+    return any(_equal(value, operand) for value in _expand(values, keep_arrays=True))
+
+
+def _match_operator(values, operator, operand):
+    if operator == "$eq":
+        return _match_equal(values, operand)
+    if operator == "$ne":
+        return not _match_equal(values, operand)
+    if operator == "$in":
+        return any(_match_equal(values, item) for item in operand)
+    if operator == "$nin":
+        return not any(_match_equal(values, item) for item in operand)
+    if operator == "$exists":
+        return bool(values) == bool(operand)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_compare(value, operator, operand) for value in _expand(values))
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == operand for value in values)
+    if operator == "$all":
+        return all(_match_equal(values, item) for item in operand)
+    if operator == "$elemMatch":
+        for value in values:
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict) and match(item, operand):
+                        return True
+                    if not isinstance(item, dict) and _match_values([item], operand):
+                        return True
+        return False
+    if operator == "$not":
+        return not _match_values(values, operand)
+    if operator == "$regex":
+        pattern = re.compile(operand) if isinstance(operand, str) else operand
+        return any(isinstance(value, str) and pattern.search(value) for value in _expand(values))
+    if operator == "$options":
+        return True
+    raise OperationFailure(f"unknown operator: {operator}", 2)
+
+
+def _equal(value, operand):
+    operand = _query_value(operand)
+    return _type_rank(value) == _type_rank(operand) and value == operand
+
+
+def _compare(value, operator, operand):
+    operand = _query_value(operand)
+    if _type_rank(value) != _type_rank(operand):
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    return value <= operand
+
+
+def _get_values(value, path):
+    """Get every value a dotted path can refer to, descending into arrays the way MongoDB does."""
+    parts = path.split(".") if isinstance(path, str) else path
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if head in value:
+            return _get_values(value[head], rest)
+        return []
+    if isinstance(value, list):
+        results = []
+        if head.isdigit() and int(head) < len(value):
+            results += _get_values(value[int(head)], rest)
+        for item in value:
+            if isinstance(item, dict):
+                results += _get_values(item, parts)
+        return results
+    return []
+
+
+def _expand(values, keep_arrays=False):
+    """Flatten array values into their elements, optionally keeping the arrays themselves."""
+    expanded = []
+    for value in values:
+        if isinstance(value, list):
+            if keep_arrays:
+                expanded.append(value)
+            expanded += value
+        else:
+            expanded.append(value)
+    return expanded
+
+
+def _equality_fields(filter):
+    """Get the fields of a query filter that a document created by an upsert inherits."""
+    fields = {}
+    for key, condition in (filter or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" not in condition:
+                continue
+            condition = condition["$eq"]
+        _set_path(fields, key, condition)
+    return fields
+
+
+def _query_value(value):
+    """Convert a datetime in a query filter the way BSON stores it: naive UTC, to the millisecond."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def _type_rank(value):
+    # isinstance() also ranks subclasses such as bson.Int64. bool comes before int in _TYPE_ORDER, since it is one.
+    for value_type, rank in _TYPE_ORDER:
+        if isinstance(value, value_type):
+            return rank
+    return 0
+
+
+def _sort_key(value, descending=False):
+    if isinstance(value, list):
+        # MongoDB sorts an array by its smallest element in ascending order and by its largest in descending order.
+        pick = max if descending else min
+        value = pick(value, key=_sort_key, default=None) if value else None
+    rank = _type_rank(value)
+    if isinstance(value, dict):
+        return rank, sorted(value.items(), key=lambda item: item[0])
+    if value is None:
+        return rank, 0
+    return rank, value
+
+
+def _sort_spec(keys):
+    """Normalize a key or sort specification into a list of (field, direction) pairs."""
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, dict):
+        return list(keys.items())
+    return [(key, 1) if isinstance(key, str) else tuple(key) for key in keys]
+
+
+def _sort_docs(docs, sort, key=lambda doc: doc):
+    for field, direction in reversed(_sort_spec(sort)):
+        docs.sort(key=lambda item: _sort_key((_get_values(key(item), field) or [None])[0], descending=direction < 0),
+                  reverse=direction < 0)
+    return docs
+
+
+def _index_key(doc, index):
+    """Get the key of a document in a unique index, or None if the index leaves the document out."""
+    if "partialFilterExpression" in index and not match(doc, index["partialFilterExpression"]):
+        return None
+    values = []
+    for field in index["fields"]:
+        found = _get_values(doc, field)
+        if not found and index.get("sparse"):
+            return None
+        values.append(_hashable(found[0]) if found else None)
+    return tuple(values)
+
+
+def _indexable_fields(filter):
+    """Get the fields of a query filter whose conditions an index can serve."""
+    fields = set()
+    for key, condition in filter.items():
+        if key == "$and":
+            for sub_query in condition:
+                fields |= _indexable_fields(sub_query)
+        elif key.startswith("$"):
+            continue
+        elif isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if set(condition) & {"$eq", "$in", "$gt", "$gte", "$lt", "$lte", "$elemMatch", "$all"}:
+                fields.add(key)
+        else:
+            fields.add(key)
+    return fields
+
+
+def _to_bson(doc):
+    return bson.decode(bson.encode(doc))
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple((k, _hashable(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _check_not_in_transaction(session, command_name):
+    if session is not None and session.in_transaction:
+        raise OperationFailure(f"Cannot run '{command_name}' in a multi-document transaction.", 263)
+
+
+def _duplicate_key_error(namespace, index_name, key):
+    return DuplicateKeyError(f"E11000 duplicate key error collection: {namespace} index: {index_name} dup key: {key}",
+                             11000)
+
+
+# Projections
+
+
+def _project(doc, projection):
+    if not projection:
+        return deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = deepcopy(doc["_id"])
+        for field in fields:
+            _copy_path(doc, result, field.split("."))
+        return result
+    result = deepcopy(doc)
+    for field in fields:
+        _unset_path(result, field)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _copy_path(source, target, parts):
+    head, rest = parts[0], parts[1:]
+    if isinstance(source, list):
+        for i, item in enumerate(source):
+            if isinstance(item, dict):
+                if len(target) <= i:
+                    target.append({})
+                _copy_path(item, target[i], parts)
+        return
+    if not isinstance(source, dict) or head not in source:
+        return
+    if not rest:
+        target[head] = deepcopy(source[head])
+    elif isinstance(source[head], dict):
+        _copy_path(source[head], target.setdefault(head, {}), rest)
+    elif isinstance(source[head], list):
+        _copy_path(source[head], target.setdefault(head, []), rest)
+
+
+# Updates
+
+
+def apply_update(doc, update, filter=None, inserting=False):
+    """Apply an update document (or a replacement if it has no operators) to a document in place."""
+    if not any(k.startswith("$") for k in update):
+        doc_id = doc.get("_id")
+        doc.clear()
+        doc.update(deepcopy(update))
+        if doc_id is not None:
+            doc["_id"] = doc_id
+        return
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        if operator not in _UPDATE_OPERATORS:
+            raise OperationFailure(f"Unknown modifier: {operator}", 9)
+        for path, operand in fields.items():
+            path = _resolve_positional(doc, path, filter)
+            _UPDATE_OPERATORS[operator](doc, path, operand)
+
+
+def _resolve_positional(doc, path, filter):
+    """Replace the positional "$" operator in an update path with the index of the first matching array element."""
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    array_path, _, rest = path.partition(".$")
+    array = (_get_values(doc, array_path) or [[]])[0]
+    sub_query = {}
+    for key, condition in (filter or {}).items():
+        if key == array_path and isinstance(condition, dict) and "$elemMatch" in condition:
+            sub_query.update(condition["$elemMatch"])
+        elif key.startswith(array_path + "."):
+            sub_query[key[len(array_path) + 1:]] = condition
+    if array_path not in (filter or {}) and not sub_query:
+        raise OperationFailure("The positional operator did not find the match needed from the query.", 2)
+    for i, item in enumerate(array):
+        if array_path in (filter or {}) and not sub_query:
+            matched = _match_values([item], filter[array_path])
+        else:
+            matched = isinstance(item, dict) and match(item, sub_query)
+        if matched:
+            return f"{array_path}.{i}{rest}"
+    raise OperationFailure("The positional operator did not find the match needed from the query.", 2)
+
+
+def _walk(doc, path, create=True):
+    """Get the container holding the last key of a dotted path, along with that key."""
+    parts = path.split(".")
+    container = doc
+    for part in parts[:-1]:
+        if isinstance(container, list):
+            container = container[int(part)]
+            continue
+        if part not in container or container[part] is None:
+            if not create:
+                return None, parts[-1]
+            container[part] = {}
+        container = container[part]
+    return container, parts[-1]
+
+
+def _get_path(doc, path, default=_MISSING):
+    container, key = _walk(doc, path, create=False)
+    if container is None:
+        return default
+    if isinstance(container, list):
+        index = int(key)
+        return container[index] if index < len(container) else default
+    return container.get(key, default)
+
+
+def _set_path(doc, path, value):
+    container, key = _walk(doc, path)
+    if isinstance(container, list):
+        container[int(key)] = value
+    else:
+        container[key] = value
+
+
+def _unset_path(doc, path):
+    container, key = _walk(doc, path, create=False)
+    if isinstance(container, dict):
+        container.pop(key, None)
+
+
+def _update_set(doc, path, value):
+    _set_path(doc, path, deepcopy(value))
+
+
+def _update_unset(doc, path, value):
+    _unset_path(doc, path)
+
+
+def _update_inc(doc, path, amount):
+    _set_path(doc, path, _get_path(doc, path, 0) + amount)
+
+
+def _update_mul(doc, path, factor):
+    _set_path(doc, path, _get_path(doc, path, 0) * factor)
+
+
+def _update_min(doc, path, value):
+    current = _get_path(doc, path)
+    if current is _MISSING or _sort_key(value) < _sort_key(current):
+        _set_path(doc, path, deepcopy(value))
+
+
+def _update_max(doc, path, value):
+    current = _get_path(doc, path)
+    if current is _MISSING or _sort_key(value) > _sort_key(current):
+        _set_path(doc, path, deepcopy(value))
+
+
+def _update_push(doc, path, value):
+    array = _get_path(doc, path)
+    if array is _MISSING:
+        array = []
+        _set_path(doc, path, array)
+    if isinstance(value, dict) and "$each" in value:
+        array += deepcopy(value["$each"])
+        if "$slice" in value:
+            n = value["$slice"]
+            array[:] = array[n:] if n < 0 else array[:n]
+    else:
+        array.append(deepcopy(value))
+
+
+def _update_add_to_set(doc, path, value):
+    array = _get_path(doc, path)
+    if array is _MISSING:
+        array = []
+        _set_path(doc, path, array)
+    items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+    for item in items:
+        if item not in array:
+            array.append(deepcopy(item))
+
+
+def _update_pull(doc, path, condition):
+    array = _get_path(doc, path)
+    if not isinstance(array, list):
+        return
+    if isinstance(condition, dict):
+        is_query = not any(k.startswith("$") for k in condition)
+        array[:] = [
+            item for item in array
+            if not (match(item, condition) if is_query and isinstance(item, dict) else _match_values([item], condition))
+        ]
+    else:
+        array[:] = [item for item in array if item != condition]
+
+
+def _update_pop(doc, path, direction):
+    array = _get_path(doc, path)
+    if isinstance(array, list) and array:
+        array.pop(0 if direction < 0 else -1)
+
+
+_UPDATE_OPERATORS = {
+    "$set": _update_set,
+    "$setOnInsert": _update_set,
+    "$unset": _update_unset,
+    "$inc": _update_inc,
+    "$mul": _update_mul,
+    "$min": _update_min,
+    "$max": _update_max,
+    "$push": _update_push,
+    "$addToSet": _update_add_to_set,
+    "$pull": _update_pull,
+    "$pop": _update_pop
+}
+
+
+# Aggregation
+
+
+def evaluate(doc, expression):
+    """Evaluate an aggregation expression against a document."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _field_value(doc, expression[1:].split("."))
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(doc, item) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            (operator, operand), = expression.items()
+            if operator in _EXPRESSION_OPERATORS:
+                return _EXPRESSION_OPERATORS[operator](doc, operand)
+        return {k: evaluate(doc, v) for k, v in expression.items()}
+    return expression
+
+
+def _field_value(value, parts):
+    """Get the value of a field path. Paths that pass through an array yield an array, as in aggregation."""
+    for i, part in enumerate(parts):
+        if isinstance(value, list):
+            values = [_field_value(item, parts[i:]) for item in value if isinstance(item, dict)]
+            return [v for v in values if v is not _MISSING]
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _args(doc, operand):
+    return [evaluate(doc, arg) for arg in (operand if isinstance(operand, list) else [operand])]
+
+
+def _expression_sum(doc, operand):
+    args = _args(doc, operand)
+    if len(args) == 1 and isinstance(args[0], list):
+        args = args[0]
+    return sum(arg for arg in args if isinstance(arg, (int, float)) and not isinstance(arg, bool))
+
+
+def _expression_avg(doc, operand):
+    args = _args(doc, operand)
+    if len(args) == 1 and isinstance(args[0], list):
+        args = args[0]
+    numbers = [arg for arg in args if isinstance(arg, (int, float)) and not isinstance(arg, bool)]
+    return sum(numbers) / len(numbers) if numbers else None
+
+
+def _expression_divide(doc, operand):
+    dividend, divisor = _args(doc, operand)
+    return dividend / divisor
+
+
+def _expression_subtract(doc, operand):
+    minuend, subtrahend = _args(doc, operand)
+    return minuend - subtrahend
+
+
+def _expression_multiply(doc, operand):
+    product = 1
+    for arg in _args(doc, operand):
+        product *= arg
+    return product
+
+
+def _expression_if_null(doc, operand):
+    for arg in _args(doc, operand):
+        if arg is not None:
+            return arg
+    return None
+
+
+def _expression_size(doc, operand):
+    return len(evaluate(doc, operand))
+
+
+def _expression_first(doc, operand):
+    array = evaluate(doc, operand)
+    return array[0] if array else None
+
+
+def _expression_compare(operator):
+    def compare(doc, operand):
+        left, right = _args(doc, operand)
+        if operator == "$eq":
+            return left == right
+        if operator == "$ne":
+            return left != right
+        return _compare(left, operator, right)
+    return compare
+
+
+def _expression_in(doc, operand):
+    value, array = _args(doc, operand)
+    return value in (array or [])
+
+
+def _expression_cond(doc, operand):
+    if isinstance(operand, dict):
+        operand = [operand["if"], operand["then"], operand["else"]]
+    condition, if_true, if_false = operand
+    return evaluate(doc, if_true) if evaluate(doc, condition) else evaluate(doc, if_false)
+
+
+_EXPRESSION_OPERATORS = {
+    "$literal": lambda doc, operand: operand,
+    "$add": lambda doc, operand: sum(_args(doc, operand)),
+    "$subtract": _expression_subtract,
+    "$multiply": _expression_multiply,
+    "$divide": _expression_divide,
+    "$sum": _expression_sum,
+    "$avg": _expression_avg,
+    "$max": lambda doc, operand: max(_args(doc, operand), key=_sort_key),
+    "$min": lambda doc, operand: min(_args(doc, operand), key=_sort_key),
+    "$ifNull": _expression_if_null,
+    "$size": _expression_size,
+    "$first": _expression_first,
+    "$in": _expression_in,
+    "$cond": _expression_cond,
+    "$eq": _expression_compare("$eq"),
+    "$ne": _expression_compare("$ne"),
+    "$gt": _expression_compare("$gt"),
+    "$gte": _expression_compare("$gte"),
+    "$lt": _expression_compare("$lt"),
+    "$lte": _expression_compare("$lte"),
+    "$and": lambda doc, operand: all(_args(doc, operand)),
+    "$or": lambda doc, operand: any(_args(doc, operand))
+}
+
+
+def _stage_match(database, docs, spec):
+    return [doc for doc in docs if match(doc, spec)]
+
+
+def _stage_project(database, docs, spec):
+    if all(v in (0, 1, True, False) for v in spec.values()):
+        return [_project(doc, spec) for doc in docs]
+    results = []
+    for doc in docs:
+        result = {"_id": doc["_id"]} if spec.get("_id", 1) and "_id" in doc else {}
+        for field, expression in spec.items():
+            if field == "_id" and expression in (0, 1, True, False):
+                continue
+            if expression in (1, True):
+                _copy_path(doc, result, field.split("."))
+            else:
+                _set_path(result, field, evaluate(doc, expression))
+        results.append(result)
+    return results
+
+
+def _stage_add_fields(database, docs, spec):
+    for doc in docs:
+        for field, expression in spec.items():
+            _set_path(doc, field, evaluate(doc, expression))
+    return docs
+
+
+def _stage_unset(database, docs, spec):
+    fields = [spec] if isinstance(spec, str) else spec
+    for doc in docs:
+        for field in fields:
+            _unset_path(doc, field)
+    return docs
+
+
+def _stage_sample(database, docs, spec):
+    return random.sample(docs, min(spec["size"], len(docs)))
+
+
+def _stage_sort(database, docs, spec):
+    return _sort_docs(docs, spec)
+
+
+def _stage_limit(database, docs, spec):
+    return docs[:spec]
+
+
+def _stage_skip(database, docs, spec):
+    return docs[spec:]
+
+
+def _stage_count(database, docs, spec):
+    return [{spec: len(docs)}] if docs else []
+
+
+def _stage_unwind(database, docs, spec):
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    path = spec["path"][1:]
+    preserve = spec.get("preserveNullAndEmptyArrays", False)
+    results = []
+    for doc in docs:
+        array = _get_path(doc, path)
+        if isinstance(array, list) and array:
+            for item in array:
+                unwound = deepcopy(doc)
+                _set_path(unwound, path, deepcopy(item))
+                results.append(unwound)
+        elif isinstance(array, list) or array is _MISSING or array is None:
+            if preserve:
+                unwound = deepcopy(doc)
+                if isinstance(array, list):
+                    _unset_path(unwound, path)
+                results.append(unwound)
+        else:
+            results.append(doc)
+    return results
+
+
+def _stage_group(database, docs, spec):
+    groups = {}
+    for doc in docs:
+        group_id = evaluate(doc, spec["_id"])
+        key = _hashable(group_id)
+        if key not in groups:
+            groups[key] = ({"_id": group_id}, [])
+        groups[key][1].append(doc)
+    results = []
+    for group, members in groups.values():
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            if operator not in _ACCUMULATORS:
+                raise OperationFailure(f"unknown group operator '{operator}'", 15952)
+            values = [evaluate(doc, expression) for doc in members]
+            group[field] = _ACCUMULATORS[operator](values)
+        results.append(group)
+    return results
+
+
+def _accumulate_avg(values):
+    numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    return sum(numbers) / len(numbers) if numbers else None
+
+
+def _accumulate_add_to_set(values):
+    unique = []
+    for value in values:
+        if value not in unique:
+            unique.append(value)
+    return unique
+
+
+_ACCUMULATORS = {
+    "$sum": lambda values: sum(v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)),
+    "$avg": _accumulate_avg,
+    "$min": lambda values: min((v for v in values if v is not None), key=_sort_key, default=None),
+    "$max": lambda values: max((v for v in values if v is not None), key=_sort_key, default=None),
+    "$first": lambda values: values[0] if values else None,
+    "$last": lambda values: values[-1] if values else None,
+    "$push": lambda values: values,
+    "$addToSet": _accumulate_add_to_set
+}
+
+
+def _stage_lookup(database, docs, spec):
+    foreign = database.get_collection(spec["from"])
+    with foreign._lock:
+        foreign_docs = list(foreign._docs.values())
+    for doc in docs:
+        local_values = _expand(_get_values(doc, spec["localField"])) or [None]
+        joined = []
+        for foreign_doc in foreign_docs:
+            foreign_values = _expand(_get_values(foreign_doc, spec["foreignField"])) or [None]
+            if any(_equal(lv, fv) for lv in local_values for fv in foreign_values):
+                joined.append(deepcopy(foreign_doc))
+        doc[spec["as"]] = joined
+    return docs
+
+
+def _stage_replace_root(database, docs, spec):
+    return [evaluate(doc, spec["newRoot"]) for doc in docs]
+
+
+_STAGES = {
+    "$match": _stage_match,
+    "$project": _stage_project,
+    "$addFields": _stage_add_fields,
+    "$set": _stage_add_fields,
+    "$unset": _stage_unset,
+    "$sample": _stage_sample,
+    "$sort": _stage_sort,
+    "$limit": _stage_limit,
+    "$skip": _stage_skip,
+    "$count": _stage_count,
+    "$unwind": _stage_unwind,
+    "$group": _stage_group,
+    "$lookup": _stage_lookup,
+    "$replaceRoot": _stage_replace_root
+}
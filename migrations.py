@@ -0,0 +1,75 @@
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Data migrations for changes to the layout of the collections. Each migration can be run again safely, so it can be
+# applied to a live database and resumed if it is interrupted.
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def move_recorded_audios(database, batch_size=1000, query=None):
+    """
+    Move the recordedAudios array of each user that matches a query into the UserRecordings collection and remove it
+    from the user document. Recordings that the server adds while a batch is being moved stay in the array for the next
+    run. Returns the number of users that were migrated.
+    """
+    num_users = 0
+    users = database.Users.find({"$and": [query or {}, {"recordedAudios": {"$exists": True}}]},
+                                {"_id": 1, "recordedAudios": 1})
+    batch = []
+    for user in users:
+        batch.append(user)
+        if len(batch) >= batch_size:
+            num_users += _move_batch(database, batch)
+            batch = []
+    if batch:
+        num_users += _move_batch(database, batch)
+    return num_users
+
+
+def _move_batch(database, users):
+    inserts = [
+        InsertOne({"userId": user["_id"], "id": recording["id"], "recType": recording["recType"]})
+        for user in users
+        for recording in user["recordedAudios"]
+    ]
+    if inserts:
+        try:
+            database.UserRecordings.bulk_write(inserts, ordered=False)
+        except BulkWriteError as e:
+            # Recordings copied by an earlier, interrupted run are already there.
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                raise
+    # Only the copied recordings are removed, and the array only once it is empty, so that a recording pushed since the
+    # user was read is not lost.
+    updates = []
+    for user in users:
+        copied_ids = [recording["id"] for recording in user["recordedAudios"]]
+        updates.append(UpdateOne({"_id": user["_id"]}, {"$pull": {"recordedAudios": {"id": {"$in": copied_ids}}}}))
+        updates.append(UpdateOne({"_id": user["_id"], "recordedAudios": {"$size": 0}},
+                                 {"$unset": {"recordedAudios": ""}}))
+    database.Users.bulk_write(updates)
+    return len(users)
+
+
+def bucket_difficulties(database, difficulty_limits, query=None):
+    """
+    Put each unrecorded question that matches a query into the bucket that its recDifficulty falls under, by writing
+    the index of the bucket to difficultyType. Each limit is the exclusive upper bound of a bucket, and None leaves the
+    last bucket unbounded. Returns the number of questions that were moved.
+    """
+    num_moved = 0
+    lower = None
+    for difficulty_type, upper in enumerate(difficulty_limits):
+        bounds = {"$exists": True}
+        if lower is not None:
+            bounds["$gte"] = lower
+        if upper is not None:
+            bounds["$lt"] = upper
+        result = database.UnrecordedQuestions.update_many(
+            {"$and": [query or {}, {"recDifficulty": bounds, "difficultyType": {"$ne": difficulty_type}}]},
+            {"$set": {"difficultyType": difficulty_type}}
+        )
+        num_moved += result.modified_count
+        lower = upper
+    return num_moved
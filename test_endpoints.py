@@ -1,16 +1,22 @@
+import hashlib
 import os
 import random
+import threading
 import time
+import tracemalloc
+import wave
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
 import logging
 
 import bson
+import flask
 import pytest
-from openapi_schema_validator import validate
 
+import migrations
 import testutil
+from blobstorage import blob_path
 
 logger = logging.getLogger(__name__)
 # TODO: Replace ROUTE class attributes with pytest fixtures that use QuizzrAPISpec.path_for()
@@ -64,8 +70,23 @@ class TestCheckAnswer:
         assert "correct" in response_body
         assert not response_body["correct"]
 
+    # Test Case: Checking several answers in one request. The results should be in the same order as the arguments.
+    def test_batch(self, client, question_id):
+        answers = [
+            (self.CORRECT_ANSWER, True),
+            (self.CORRECT_ANSWER_INSERTIONS, True),
+            (self.CORRECT_ANSWER_TYPOS, True),
+            (self.INCORRECT_ANSWER, False)
+        ]
+        response = client.post(self.ROUTE, json={"arguments": [{"qid": question_id, "a": a} for a, _ in answers]})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert len(response_body["results"]) == len(answers)
+        for result, (_, correct) in zip(response_body["results"], answers):
+            assert result["correct"] == correct
+
 
-@pytest.mark.usefixtures("blob_file", "client")
+@pytest.mark.usefixtures("blob_file", "client", "input_dir")
 class TestGetFile:
     ROUTE = "/audio"
 
@@ -73,19 +94,70 @@ class TestGetFile:
     def full_route(self, blob_file):
         return "/".join([self.ROUTE, "normal", blob_file])
 
+    @pytest.fixture(scope="session")
+    def file_contents(self, input_dir):
+        with open(os.path.join(input_dir, "test.wav"), "rb") as f:
+            return f.read()
+
     def test_download(self, client, full_route):
         response = client.get(full_route)
         assert testutil.match_status(HTTPStatus.OK, response.status)
 
+    # Test Case: Downloading the whole file. The server should advertise that it accepts range requests.
+    def test_download_whole(self, client, full_route, file_contents):
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.headers.get("Accept-Ranges") == "bytes"
+        assert response.get_data() == file_contents
+
+    # Test Cases: Downloading part of the file, given as the first and last byte positions, only the first byte
+    # position, and only the number of bytes at the end of the file.
+    @pytest.mark.parametrize("byte_range, start, end", [
+        ("0-99", 0, 99),
+        ("100-1123", 100, 1123),
+        ("1000-", 1000, None),
+        ("-100", -100, None)
+    ])
+    def test_download_range(self, client, full_route, file_contents, byte_range, start, end):
+        size = len(file_contents)
+        first = start if start >= 0 else size + start
+        last = end if end is not None else size - 1
+        response = client.get(full_route, headers={"Range": f"bytes={byte_range}"})
+        assert response.status_code == HTTPStatus.PARTIAL_CONTENT
+        assert response.headers["Content-Range"] == f"bytes {first}-{last}/{size}"
+        assert int(response.headers["Content-Length"]) == last - first + 1
+        assert response.get_data() == file_contents[first:last + 1]
+
+    # Test Case: Downloading a range that starts past the end of the file.
+    def test_download_range_unsatisfiable(self, client, full_route, file_contents):
+        size = len(file_contents)
+        response = client.get(full_route, headers={"Range": f"bytes={size}-"})
+        assert response.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+        assert response.headers["Content-Range"] == f"bytes */{size}"
+
 
 @pytest.mark.usefixtures("client", "mongodb", "api_spec")
 class TestGetLeaderboard:
     ROUTE = "/leaderboard"
+    NUM_USERS = 5
+    # Large enough that no leaderboard page reaches it.
+    HIGH_COMPRESS_MIN_SIZE = 1024 ** 3
+
+    @pytest.fixture(scope="class")
+    def compressing_client(self, app_factory):
+        """Get a client of a server that compresses every response, however small."""
+        with app_factory(COMPRESS_MIN_SIZE=0).test_client() as client:
+            return client
+
+    @pytest.fixture(scope="class")
+    def non_compressing_client(self, app_factory):
+        with app_factory(COMPRESS_MIN_SIZE=self.HIGH_COMPRESS_MIN_SIZE).test_client() as client:
+            return client
 
     @pytest.fixture
     def users(self, mongodb, api_spec):
         user_docs = []
-        for i in range(5):
+        for i in range(self.NUM_USERS):
             profile = api_spec.get_schema_stub("User")
             profile.update({
                 "_id": testutil.generate_uid(),
@@ -93,16 +165,33 @@ class TestGetLeaderboard:
                 "ratings": {
                     "all": i + 1,
                     "literature": i + 1,
-                    "mathematics": 5 - i
+                    "mathematics": self.NUM_USERS - i
                 }
             })
             user_docs.append(profile)
         random.shuffle(user_docs)
 
         results = mongodb.Users.insert_many(user_docs)
-        yield
+        yield user_docs
         mongodb.Users.delete_many({"_id": {"$in": results.inserted_ids}})
 
+    def get_usernames(self, client, category, page_size=2):
+        """Walk through every page of the leaderboard of a category and get the usernames in order."""
+        usernames = []
+        cursor = None
+        while True:
+            query_string = {"category": category, "size": page_size}
+            if cursor:
+                query_string["cursor"] = cursor
+            response = client.get(self.ROUTE, query_string=query_string)
+            assert response.status_code == HTTPStatus.OK
+            response_body = response.get_json()
+            assert len(response_body["results"]) <= page_size
+            usernames += [profile["username"] for profile in response_body["results"]]
+            cursor = response_body.get("next")
+            if not cursor:
+                return usernames
+
     @pytest.mark.parametrize("category", ["all", "literature", "mathematics"])
     def test_get(self, client, mongodb, category):
         response = client.get(self.ROUTE, query_string={"category": category})
@@ -116,20 +205,117 @@ class TestGetLeaderboard:
                 assert rating < prev_rating
             prev_rating = rating
 
+    # Test Case: Asking for a compressed leaderboard. The decompressed body should be the same as the uncompressed one.
+    @pytest.mark.parametrize("encoding", ["gzip", "br"])
+    def test_compressed(self, client, compressing_client, users, encoding):
+        if encoding == "br":
+            pytest.importorskip("brotli")
+        query_string = {"category": "all"}
+        response = compressing_client.get(self.ROUTE, query_string=query_string, headers={"Accept-Encoding": encoding})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.headers.get("Content-Encoding") == encoding
+        assert "Accept-Encoding" in response.headers.get("Vary", "")
+        assert int(response.headers["Content-Length"]) == len(response.get_data())
+        expected = client.get(self.ROUTE, query_string=query_string, headers={"Accept-Encoding": "identity"})
+        assert testutil.get_json_body(response) == expected.get_json()
+
+    # Test Case: Not asking for compression.
+    def test_uncompressed_identity(self, compressing_client, users):
+        response = compressing_client.get(self.ROUTE, query_string={"category": "all"},
+                                          headers={"Accept-Encoding": "identity"})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.headers.get("Content-Encoding", "identity") == "identity"
+        assert response.get_json()["results"]
+
+    # Test Case: Asking for compression when the body is smaller than the threshold.
+    def test_uncompressed_threshold(self, non_compressing_client, users):
+        response = non_compressing_client.get(self.ROUTE, query_string={"category": "all"},
+                                              headers={"Accept-Encoding": "gzip, br"})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.headers.get("Content-Encoding", "identity") == "identity"
+        assert response.get_json()["results"]
+
+    # Test Case: Serializing the types that MongoDB documents hold but JSON does not. An ObjectId should become its hex
+    # string and a datetime an ISO 8601 timestamp of the same instant.
+    def test_serialization(self, flask_app):
+        object_id = bson.ObjectId()
+        timestamp = datetime.now(timezone.utc).replace(microsecond=0)
+        with flask_app.app_context():
+            body = flask.json.loads(flask.json.dumps({"_id": object_id, "timestamp": timestamp}))
+        assert body["_id"] == str(object_id)
+        parsed_timestamp = datetime.fromisoformat(body["timestamp"].replace("Z", "+00:00"))
+        if parsed_timestamp.tzinfo is None:
+            parsed_timestamp = parsed_timestamp.replace(tzinfo=timezone.utc)
+        assert parsed_timestamp == timestamp
+
+    # Test Case: Walking through the leaderboard one page at a time. The pages should continue where the previous page
+    # left off, without repeating any user.
+    @pytest.mark.parametrize("category", ["all", "mathematics"])
+    def test_pagination(self, client, mongodb, users, category):
+        usernames = self.get_usernames(client, category)
+        prev_rating = None
+        for username in usernames:
+            live_profile = mongodb.Users.find_one({"username": username}, {"ratings": 1})
+            rating = live_profile["ratings"][category]
+            if prev_rating is not None:
+                assert rating <= prev_rating
+            prev_rating = rating
+        assert len(usernames) == len(set(usernames))
+        assert {user["username"] for user in users} <= set(usernames)
+
+    # Test Case: Submitting game results for the lowest-rated user after the leaderboard has been read. The leaderboard
+    # should be updated along with the ratings, so the users should still be in the order of their live ratings.
+    def test_game_results(self, client, mongodb, users, socket_server_key):
+        category = "literature"
+        self.get_usernames(client, category)
+        lowest_user = min(users, key=lambda user: user["ratings"][category])
+        update_args = {
+            "mode": "competitive",
+            "category": category,
+            "users": {
+                lowest_user["username"]: {
+                    "questionStats": {
+                        "played": 10,
+                        "buzzed": 10,
+                        "correct": 10,
+                        "cumulativeProgressOnBuzz": {
+                            "percentQuestionRead": 2.5,
+                            "numSentences": 10
+                        }
+                    },
+                    "finished": True,
+                    "won": True
+                }
+            }
+        }
+        response = client.put(TestProcessGameResults.ROUTE, json=update_args,
+                              headers={"Authorization": socket_server_key})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+
+        live_ratings = {
+            user["username"]: user["ratings"][category]
+            for user in mongodb.Users.find({"_id": {"$in": [user["_id"] for user in users]}},
+                                           {"username": 1, "ratings": 1})
+        }
+        usernames = [username for username in self.get_usernames(client, category) if username in live_ratings]
+        assert sorted(usernames) == sorted(live_ratings)
+        ratings = [live_ratings[username] for username in usernames]
+        assert ratings == sorted(ratings, reverse=True)
+
 
-@pytest.mark.usefixtures("mongodb", "client", "flask_app", "api_spec")
+@pytest.mark.usefixtures("mongodb", "client", "flask_app", "api_spec", "clear_caches")
 class TestGetRec:
     ROUTE = "/question"
+    CACHE_NAME = "recordings"
+    CATEGORY_TRIALS = 5
 
     @pytest.fixture(scope="session")
     def path_op_pair(self, api_spec):
         return api_spec.path_for("pick_game_question")
 
     @pytest.fixture(scope="session")
-    def schema(self, path_op_pair, api_spec):
-        op_content = api_spec.api["paths"][path_op_pair[0]][path_op_pair[1]]
-        schema = op_content["responses"][str(int(HTTPStatus.OK))]["content"]["application/json"]["schema"]
-        return api_spec.build_schema(schema)
+    def schema_validator(self, validators):
+        return validators.for_response("pick_game_question")
 
     @pytest.fixture
     def doc_setup(self, mongodb, flask_app):
@@ -280,22 +466,22 @@ class TestGetRec:
         mongodb.Audio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
 
     # Test Case: Not segmented
-    def test_whole(self, path_op_pair, client, mongodb, doc_setup, schema):
+    def test_whole(self, client, mongodb, doc_setup, schema_validator):
         response = client.get(self.ROUTE)
         assert testutil.match_status(HTTPStatus.OK, response.status)
         response_body = response.get_json()
-        validate(response_body, schema)
+        schema_validator.validate(response_body)
         question = response_body["results"][0]
         audio = question["audio"][0]
         doc = mongodb.Audio.find_one({"_id": audio["id"]})
         assert doc == doc_setup
 
     # Test Case: Segmented
-    def test_segmented(self, client, mongodb, doc_setup_segmented, schema):
+    def test_segmented(self, client, mongodb, doc_setup_segmented, schema_validator):
         response = client.get(self.ROUTE)
         assert testutil.match_status(HTTPStatus.OK, response.status)
         response_body = response.get_json()
-        validate(response_body, schema)
+        schema_validator.validate(response_body)
         for question in response_body["results"]:
             expected_uid = None
             for audio in question["audio"]:
@@ -306,19 +492,122 @@ class TestGetRec:
                 else:
                     assert expected_uid == uid
 
+    # Test Case: Getting the same question twice. The second request should reuse the recordings chosen for the first.
+    def test_cache_hit(self, client, flask_app, doc_setup):
+        testutil.require_route(flask_app, "/stats/cache")
+        before = testutil.get_cache_stats(client, self.CACHE_NAME)
+        for _ in range(2):
+            response = client.get(self.ROUTE)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+        after = testutil.get_cache_stats(client, self.CACHE_NAME)
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+        assert 0 < after["size"] <= after["maxSize"]
+
+    # Test Case: Voting on a recording of a cached question. The vote can change which recordings are the best, so the
+    # next request should choose them again.
+    @pytest.mark.parametrize("vote_route", ["/upvote", "/downvote"])
+    def test_cache_invalidate_vote(self, client, mongodb, flask_app, doc_setup, vote_route):
+        testutil.require_route(flask_app, "/stats/cache")
+        user_id = testutil.generate_uid()
+        mongodb.Users.insert_one({"_id": user_id})
+        try:
+            response = client.get(self.ROUTE)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            response = client.patch(f"{vote_route}/{doc_setup['_id']}", json={"userId": user_id})
+            assert response.status_code == HTTPStatus.OK
+            before = testutil.get_cache_stats(client, self.CACHE_NAME)
+            response = client.get(self.ROUTE)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            after = testutil.get_cache_stats(client, self.CACHE_NAME)
+            assert after["misses"] - before["misses"] == 1
+        finally:
+            mongodb.Users.delete_one({"_id": user_id})
+            mongodb.Votes.delete_many({"userId": user_id})
+
+    # Test Case: Processing a recording of a cached question that scores better than the others. The next request should
+    # miss the cache and return the new recording.
+    def test_cache_invalidate_process(self, client, mongodb, flask_app, doc_setup):
+        testutil.require_route(flask_app, "/stats/cache")
+        audio_id = testutil.generate_audio_id()
+        question = mongodb.RecordedQuestions.find_one({"recordings.id": doc_setup["_id"]})
+        mongodb.UnprocessedAudio.insert_one({
+            "_id": audio_id,
+            "qb_id": doc_setup["qb_id"],
+            "userId": doc_setup["userId"],
+            "gentleVtt": "Foo",
+            "recType": "normal",
+            "version": flask_app.config["VERSION"]
+        })
+        try:
+            response = client.get(self.ROUTE)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            response = client.patch(TestProcessAudio.ROUTE, json={"arguments": [{
+                "_id": audio_id,
+                "vtt": "Bar",
+                "score": {"wer": 0.0, "mer": 0.0, "wil": 0.0},
+                "transcript": question["transcript"],
+                "batchNumber": str(datetime.now()),
+                "metadata": "detect_num_speakers=False, max_num_speakers=1"
+            }]})
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            assert response.get_json()["successes"] == 1
+
+            before = testutil.get_cache_stats(client, self.CACHE_NAME)
+            response = client.get(self.ROUTE)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            after = testutil.get_cache_stats(client, self.CACHE_NAME)
+            assert after["misses"] - before["misses"] == 1
+            response_body = response.get_json()
+            assert audio_id in [audio["id"] for question in response_body["results"] for audio in question["audio"]]
+        finally:
+            mongodb.UnprocessedAudio.delete_one({"_id": audio_id})
+            mongodb.Audio.delete_one({"_id": audio_id})
+            mongodb.UserRecordings.delete_many({"id": audio_id})
+
+    # Test Case: Segmented, choosing the speaker with the best scores. In doc_setup_segmented, the second user's best
+    # recording of sentence i has a WER of i + 1, which beats the first user's best recordings overall. Each sentence
+    # should come from that user's best recording of it.
+    def test_segmented_best_speaker(self, client, mongodb, doc_setup_segmented, schema_validator):
+        worse_uid = doc_setup_segmented[0]["userId"]
+        response = client.get(self.ROUTE)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        schema_validator.validate(response_body)
+        for question in response_body["results"]:
+            for audio in question["audio"]:
+                doc = mongodb.Audio.find_one({"_id": audio["id"]})
+                assert doc["userId"] != worse_uid
+                assert doc["score"]["wer"] == doc["sentenceId"] + 1
+
     @pytest.mark.parametrize("categories", [
         ["literature"],
         ["literature", "history"],
         ["literature", "history", "mathematics", "science"]
     ])
-    def test_categorical(self, client, mongodb, doc_setup_categorical, schema, categories):
+    def test_categorical(self, client, mongodb, doc_setup_categorical, schema_validator, categories):
         response = client.get(self.ROUTE, query_string={"category": categories})
         assert testutil.match_status(HTTPStatus.OK, response.status)
         response_body = response.get_json()
-        validate(response_body, schema)
+        schema_validator.validate(response_body)
         for question in response_body["results"]:
             assert question["category"] in categories
 
+    # Test Case: Weighting the requested categories. A category with no weight should never be chosen.
+    @pytest.mark.parametrize("categories, weights", [
+        (["literature", "history"], [1, 0]),
+        (["literature", "history", "mathematics", "science"], [0, 0, 1, 3])
+    ])
+    def test_categorical_weights(self, client, mongodb, doc_setup_categorical, schema_validator, categories, weights):
+        weighted_categories = [cat for cat, weight in zip(categories, weights) if weight > 0]
+        for _ in range(self.CATEGORY_TRIALS):
+            response = client.get(self.ROUTE, query_string={"category": categories, "categoryWeight": weights})
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            response_body = response.get_json()
+            schema_validator.validate(response_body)
+            for question in response_body["results"]:
+                assert question["category"] in weighted_categories
+
 
 @pytest.mark.usefixtures("client", "flask_app", "mongodb")
 class TestGetTranscript:
@@ -370,18 +659,19 @@ class TestGetTranscript:
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
     @pytest.fixture
-    def difficulties_question(self, mongodb, rec_difficulties):
+    def difficulties_question(self, mongodb, rec_difficulties, difficulty_limits):
         question_docs = []
         for d in rec_difficulties:
             for j in range(0, self.NUM_SENTENCES):
                 question_docs.append({"qb_id": d, "sentenceId": j, "transcript": "Foo", "recDifficulty": d})
 
         question_results = mongodb.UnrecordedQuestions.insert_many(question_docs)
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": question_results.inserted_ids}})
         yield question_results.inserted_ids
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
     @pytest.fixture
-    def difficulties_questions(self, mongodb, difficulty_bounds):
+    def difficulties_questions(self, mongodb, difficulty_bounds, difficulty_limits):
         question_docs = []
         for i in range(difficulty_bounds[0], difficulty_bounds[1] + 1):
             for j in range(0, self.NUM_SENTENCES):
@@ -393,6 +683,7 @@ class TestGetTranscript:
                 })
 
         question_results = mongodb.UnrecordedQuestions.insert_many(question_docs)
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": question_results.inserted_ids}})
         yield question_results.inserted_ids
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
@@ -428,29 +719,31 @@ class TestGetTranscript:
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
     @pytest.fixture
-    def difficulties_question_batch(self, mongodb, rec_difficulties):
+    def difficulties_question_batch(self, mongodb, rec_difficulties, difficulty_limits):
         question_docs = []
         for d in rec_difficulties:
             for i in range(0, self.BATCH_SIZE + 1):
                 question_docs.append({"transcript": "Foo", "recDifficulty": d})
 
         question_results = mongodb.UnrecordedQuestions.insert_many(question_docs)
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": question_results.inserted_ids}})
         yield question_results.inserted_ids
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
     @pytest.fixture
-    def difficulties_question_batch_random(self, mongodb, rec_difficulties):
+    def difficulties_question_batch_random(self, mongodb, rec_difficulties, difficulty_limits):
         question_docs = []
         for d in rec_difficulties:
             for i in range(0, self.MIN_DOCS_RANDOM * self.BATCH_SIZE):
                 question_docs.append({"transcript": str(bson.ObjectId()), "recDifficulty": d})  # Equivalence buster
 
         question_results = mongodb.UnrecordedQuestions.insert_many(question_docs)
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": question_results.inserted_ids}})
         yield question_results.inserted_ids
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
     @pytest.fixture(scope="class")
-    def questions(self, mongodb, rec_difficulties):
+    def questions(self, mongodb, rec_difficulties, difficulty_limits):
         sentence_docs = []
         qb_id = 0
         for d in rec_difficulties:
@@ -465,6 +758,7 @@ class TestGetTranscript:
                     qb_id += 1
 
         question_results = mongodb.UnrecordedQuestions.insert_many(sentence_docs)
+        migrations.bucket_difficulties(mongodb, difficulty_limits, {"_id": {"$in": question_results.inserted_ids}})
         yield question_results.inserted_ids
         mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": question_results.inserted_ids}})
 
@@ -561,6 +855,63 @@ class TestGetTranscript:
             attempts += 1
         assert attempts < max_attempts
 
+    # Test Case: Drawing batches until every question of each difficulty should have been served. Questions are drawn
+    # from a shuffled pool without replacement, so no batch repeats a question, and any two passes over the pool
+    # include every question at least once.
+    def test_difficulty_batch_coverage(self, client, mongodb, questions, difficulty_limits):
+        for j, limit in enumerate(difficulty_limits):
+            query = {"recDifficulty": {}}
+            if j > 0:
+                query["recDifficulty"]["$gte"] = difficulty_limits[j - 1]
+            if limit is not None:
+                query["recDifficulty"]["$lt"] = limit
+            pool_size = len(mongodb.UnrecordedQuestions.distinct("qb_id", query))
+            expected_ids = set(mongodb.UnrecordedQuestions.distinct("qb_id", {"_id": {"$in": questions}, **query}))
+
+            seen_ids = set()
+            num_draws = 2 * -(-pool_size // self.BATCH_SIZE) + 1
+            for _ in range(num_draws):
+                response = client.get(self.ROUTE, query_string={"difficultyType": j, "batchSize": self.BATCH_SIZE})
+                assert testutil.match_status(HTTPStatus.OK, response.status)
+                batch_ids = [doc["id"] for doc in response.get_json()["results"]]
+                assert len(batch_ids) == len(set(batch_ids))
+                seen_ids.update(batch_ids)
+            assert expected_ids <= seen_ids
+
+    # Test Case: Starting a server when the questions have no difficulty buckets. The server should put each question
+    # into the bucket that its difficulty falls under.
+    def test_difficulty_type(self, app_factory, mongodb, questions, difficulty_limits):
+        mongodb.UnrecordedQuestions.update_many({"_id": {"$in": questions}}, {"$unset": {"difficultyType": ""}})
+        app_factory()
+        for question in mongodb.UnrecordedQuestions.find({"_id": {"$in": questions}}):
+            expected_type = testutil.get_difficulty_type(question["recDifficulty"], difficulty_limits)
+            assert question["difficultyType"] == expected_type
+
+    # Test Case: The queries that the server runs for the difficultyType and batchSize parameters should be served by an
+    # index on the precomputed difficulty bucket instead of a range query over recDifficulty.
+    def test_difficulty_batch_index(self, mongodb, recorded_client, command_recorder, questions, difficulty_limits):
+        for j in range(len(difficulty_limits)):
+            command_recorder.clear()
+            response = recorded_client.get(self.ROUTE, query_string={"difficultyType": j, "batchSize": self.BATCH_SIZE})
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            commands = command_recorder.queries("UnrecordedQuestions")
+            assert commands
+            for command in commands:
+                stages = testutil.get_plan_stages(testutil.explain_command(mongodb, command))
+                assert "IXSCAN" in stages
+                assert "COLLSCAN" not in stages
+
+    # Test Case: Starting the server with different difficulty limits should move every question into the bucket that
+    # its difficulty falls under with the new limits.
+    def test_rebucket(self, app_factory, mongodb, difficulties_questions, difficulty_limits):
+        new_limits = [limit + 1 if limit is not None else None for limit in difficulty_limits]
+        try:
+            app_factory(DIFFICULTY_LIMITS=new_limits)
+            for question in mongodb.UnrecordedQuestions.find({"_id": {"$in": difficulties_questions}}):
+                assert question["difficultyType"] == testutil.get_difficulty_type(question["recDifficulty"], new_limits)
+        finally:
+            app_factory(DIFFICULTY_LIMITS=difficulty_limits)
+
     # Test Case: Difficulty and batch size parameters combined
     def test_difficulty_batch(self, client, mongodb, questions, difficulty_limits):
         for i in range(0, self.DIFFICULTY_TRIALS):
@@ -598,6 +949,10 @@ class TestGetTranscript:
 class TestGetUnprocAudio:
     ROUTE = "/audio"
     NUM_SENTENCES = 5
+    NUM_LEASED = 60
+    LEASE_BATCH_SIZE = 4
+    LEASE_SECONDS = 600
+    LEASE_THREADS = 8
 
     @pytest.fixture
     def unrec_question(self, mongodb):
@@ -695,6 +1050,25 @@ class TestGetUnprocAudio:
         yield
         mongodb.UnprocessedAudio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
 
+    @pytest.fixture
+    def doc_setup_many(self, mongodb, unrec_question):
+        audio_docs = [{"_id": testutil.generate_audio_id(), "qb_id": unrec_question} for _ in range(self.NUM_LEASED)]
+        audio_results = mongodb.UnprocessedAudio.insert_many(audio_docs)
+        yield audio_results.inserted_ids
+        mongodb.UnprocessedAudio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
+
+    def checkout(self, client, batch_size=None):
+        """Check out a batch of unprocessed audio. Returns the response body, or None if there is nothing left."""
+        query_string = {"leaseSeconds": self.LEASE_SECONDS}
+        if batch_size:
+            query_string["batchSize"] = batch_size
+        response = client.get(self.ROUTE, query_string=query_string)
+        if response.status_code == HTTPStatus.NOT_FOUND:
+            return None
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        return response_body if response_body.get("results") else None
+
     # Test Case: Two audio documents submitted by a normal user
     def test_normal(self, client, doc_setup_normal):
         required_doc_fields = ["_id", "transcript"]
@@ -728,10 +1102,84 @@ class TestGetUnprocAudio:
             for field in required_doc_fields:
                 assert field in doc
 
+    # Test Case: A checked out batch comes with a lease token and an expiry, which are stored on each document.
+    def test_lease(self, client, mongodb, doc_setup_many):
+        response_body = self.checkout(client, self.LEASE_BATCH_SIZE)
+        assert response_body is not None
+        assert len(response_body["results"]) <= self.LEASE_BATCH_SIZE
+        assert "leaseToken" in response_body
+        expiry = datetime.fromisoformat(response_body["leaseExpiry"].replace("Z", "+00:00"))
+        if expiry.tzinfo is None:
+            expiry = expiry.replace(tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        assert now < expiry <= now + timedelta(seconds=self.LEASE_SECONDS)
+        for doc in response_body["results"]:
+            audio_doc = mongodb.UnprocessedAudio.find_one({"_id": doc["_id"]})
+            assert audio_doc["lease"]["token"] == response_body["leaseToken"]
+
+    # Test Case: Documents under an active lease are not handed out again.
+    def test_lease_exclusive(self, client, doc_setup_many):
+        first_body = self.checkout(client, self.LEASE_BATCH_SIZE)
+        second_body = self.checkout(client, self.LEASE_BATCH_SIZE)
+        assert first_body is not None and second_body is not None
+        assert first_body["leaseToken"] != second_body["leaseToken"]
+        first_ids = {doc["_id"] for doc in first_body["results"]}
+        second_ids = {doc["_id"] for doc in second_body["results"]}
+        assert first_ids.isdisjoint(second_ids)
+
+    # Test Case: Documents whose lease has expired can be checked out again under a new lease.
+    def test_lease_expired(self, client, mongodb, doc_setup_many):
+        mongodb.UnprocessedAudio.update_many({"_id": {"$in": doc_setup_many}}, {"$set": {"lease": {
+            "token": "expired",
+            "expiry": datetime.now(timezone.utc) - timedelta(seconds=self.LEASE_SECONDS)
+        }}})
+        response_body = self.checkout(client, self.LEASE_BATCH_SIZE)
+        assert response_body is not None
+        assert response_body["leaseToken"] != "expired"
+        assert all(doc["_id"] in doc_setup_many for doc in response_body["results"])
+
+    # Test Case: Several workers check out batches at the same time until nothing is left. Every document of the fixture
+    # should be handed out exactly once. Other unprocessed audio in the database may be handed out as well.
+    def test_lease_concurrent(self, flask_app, mongodb, doc_setup_many):
+        checked_out = [[] for _ in range(self.LEASE_THREADS)]
+        errors = []
+        # A server that does not lease hands out the same documents forever, so the workers stop after enough batches
+        # for every unprocessed document, plus one empty checkout per worker and some slack.
+        max_checkouts = mongodb.UnprocessedAudio.count_documents({}) // self.LEASE_BATCH_SIZE + 2 * self.LEASE_THREADS
+        num_checkouts = [0]
+        lock = threading.Lock()
+
+        def worker(worker_ids):
+            try:
+                with flask_app.test_client() as worker_client:
+                    while True:
+                        with lock:
+                            num_checkouts[0] += 1
+                            over_limit = num_checkouts[0] > max_checkouts
+                        assert not over_limit, "Checked out more batches than there are documents"
+                        response_body = self.checkout(worker_client, self.LEASE_BATCH_SIZE)
+                        if response_body is None:
+                            break
+                        worker_ids.extend(doc["_id"] for doc in response_body["results"])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(ids,)) for ids in checked_out]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        fixture_ids = set(doc_setup_many)
+        all_ids = [audio_id for worker_ids in checked_out for audio_id in worker_ids if audio_id in fixture_ids]
+        assert len(all_ids) == len(set(all_ids))
+        assert set(all_ids) == fixture_ids
+
 
 @pytest.mark.usefixtures("client", "mongodb")
 class TestProcessAudio:
     ROUTE = "/audio"
+    NUM_BATCH_DOCS = 10
 
     @pytest.fixture
     def unrec_question(self, mongodb):
@@ -747,6 +1195,7 @@ class TestProcessAudio:
         result = mongodb.Users.insert_one(user_doc)
         yield user_doc
         mongodb.Users.delete_one({"_id": result.inserted_id})
+        mongodb.UserRecordings.delete_many({"userId": result.inserted_id})
 
     @pytest.fixture
     def unproc_audio_document_id(self, mongodb, unrec_question, user, flask_app):
@@ -764,6 +1213,38 @@ class TestProcessAudio:
         yield audio_result.inserted_id
         mongodb.UnprocessedAudio.delete_one({"_id": audio_result.inserted_id})
 
+    @pytest.fixture
+    def unproc_audio_document_ids(self, mongodb, unrec_question, user, flask_app):
+        audio_docs = [{
+            "_id": testutil.generate_audio_id(),
+            "qb_id": unrec_question["qb_id"],
+            "sentenceId": unrec_question["sentenceId"],
+            "userId": user["_id"],
+            "gentleVtt": "Foo",
+            "recType": "normal",
+            "version": flask_app.config["VERSION"]
+        } for _ in range(self.NUM_BATCH_DOCS)]
+        audio_results = mongodb.UnprocessedAudio.insert_many(audio_docs)
+        yield audio_results.inserted_ids
+        mongodb.UnprocessedAudio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
+        mongodb.Audio.delete_many({"_id": {"$in": audio_results.inserted_ids}})
+
+    @pytest.fixture
+    def update_batch_mixed(self, unrec_question, unproc_audio_document_ids):
+        """A batch where every other item refers to an unprocessed audio document that does not exist."""
+        batch = []
+        for audio_id in unproc_audio_document_ids:
+            for item_id in [audio_id, testutil.generate_audio_id()]:
+                batch.append({
+                    "_id": item_id,
+                    "vtt": "Bar",
+                    "score": {"wer": 1.0, "mer": 1.0, "wil": 1.0},
+                    "transcript": unrec_question["transcript"],
+                    "batchNumber": str(datetime.now()),
+                    "metadata": "detect_num_speakers=False, max_num_speakers=1"
+                })
+        return batch
+
     @pytest.fixture
     def update_batch(self, mongodb, unrec_question, unproc_audio_document_id):
         batch = [
@@ -804,6 +1285,61 @@ class TestProcessAudio:
         assert recording["id"] == unproc_audio_document_id
         assert recording["recType"] == "normal"
 
+    # Test Case: Send a batch with one update document to a server that keeps the recordings of each user in the
+    # UserRecordings collection, which came with the route for listing them.
+    def test_single_user_recordings(self, client, mongodb, flask_app, update_batch, unproc_audio_document_id, user):
+        testutil.require_route(flask_app, "/recordings")
+        response = client.patch(self.ROUTE, json={"arguments": update_batch})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+
+        recording = mongodb.UserRecordings.find_one({"userId": user["_id"]})
+        assert recording["id"] == unproc_audio_document_id
+        assert recording["recType"] == "normal"
+        assert not mongodb.Users.find_one({"_id": user["_id"]}).get("recordedAudios")
+
+    # Test Case: Send a batch where half of the update documents refer to unprocessed audio that does not exist. The
+    # valid half should be applied in full and the invalid half should be counted as failures without side effects.
+    def test_mixed(self, client, mongodb, update_batch_mixed, unproc_audio_document_ids, unrec_question, user):
+        response = client.patch(self.ROUTE, json={"arguments": update_batch_mixed})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["total"] == len(update_batch_mixed)
+        assert response_body["successes"] == len(unproc_audio_document_ids)
+
+        invalid_ids = [item["_id"] for item in update_batch_mixed if item["_id"] not in unproc_audio_document_ids]
+        assert mongodb.Audio.count_documents({"_id": {"$in": unproc_audio_document_ids}}) \
+            == len(unproc_audio_document_ids)
+        assert mongodb.UnprocessedAudio.count_documents({"_id": {"$in": unproc_audio_document_ids}}) == 0
+        assert mongodb.Audio.count_documents({"_id": {"$in": invalid_ids}}) == 0
+
+        question_doc = mongodb.RecordedQuestions.find_one({
+            "qb_id": unrec_question["qb_id"],
+            "sentenceId": unrec_question["sentenceId"]
+        })
+        assert sorted(recording["id"] for recording in question_doc["recordings"]) \
+            == sorted(unproc_audio_document_ids)
+        user_doc = mongodb.Users.find_one({"_id": user["_id"]})
+        assert sorted(recording["id"] for recording in user_doc["recordedAudios"]) == sorted(unproc_audio_document_ids)
+
+    # Test Case: Send a batch where an item in the middle cannot be applied because its audio document already exists.
+    # The batch is applied in one transaction, so none of its items should be applied. As with the items of test_mixed,
+    # the failures are reported in the response body, not through the status code.
+    def test_rollback(self, client, mongodb, update_batch_mixed, unproc_audio_document_ids, unrec_question, user):
+        batch = [item for item in update_batch_mixed if item["_id"] in unproc_audio_document_ids]
+        conflict_id = batch[len(batch) // 2]["_id"]
+        mongodb.Audio.insert_one({"_id": conflict_id})
+        response = client.patch(self.ROUTE, json={"arguments": batch})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["total"] == len(batch)
+        assert response_body["successes"] == 0
+
+        batch_ids = [item["_id"] for item in batch]
+        assert mongodb.UnprocessedAudio.count_documents({"_id": {"$in": batch_ids}}) == len(batch_ids)
+        assert mongodb.Audio.count_documents({"_id": {"$in": batch_ids}}) == 1
+        assert not mongodb.RecordedQuestions.find_one({"recordings.id": {"$in": batch_ids}})
+        assert not mongodb.UserRecordings.find_one({"id": {"$in": batch_ids}})
+
 
 @pytest.mark.usefixtures("client", "mongodb", "socket_server_key")
 class TestProcessGameResults:
@@ -1223,6 +1759,22 @@ class TestProcessGameResults:
             live_user = mongodb.Users.find_one({"_id": user["_id"]})
             assert "stats" in live_user
 
+    # Test Case: Multiple users, one of whom does not exist. The other users should still be updated, and only the
+    # existing users should be counted as successful.
+    def test_multiple_unknown_user(self, client, mongodb, users, update_args_multiple, socket_server_key):
+        update_args = deepcopy(update_args_multiple)
+        unknown_username = testutil.generate_uid()
+        update_args["users"][unknown_username] = update_args["users"][users[0]["username"]]
+        response = client.put(self.ROUTE, json=update_args, headers={"Authorization": socket_server_key})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["requested"] == len(users) + 1
+        assert response_body["successful"] == len(users)
+        for user in users:
+            live_user = mongodb.Users.find_one({"_id": user["_id"]})
+            assert "stats" in live_user
+        assert not mongodb.Users.find_one({"username": unknown_username})
+
     # Test Case: One user, multiple categories. Test multiple updates and assert that they work as intended.
     def test_multi_category(self, client, mongodb, user,
                             update_args_multi_category, socket_server_key, expected_results_multi_category):
@@ -1236,13 +1788,17 @@ class TestProcessGameResults:
             assert live_user == expected_results_multi_category[i]
 
 
-@pytest.mark.usefixtures("client", "mongodb", "firebase_bucket", "input_dir", "dev_uid")
+@pytest.mark.usefixtures("client", "mongodb", "bucket", "input_dir", "dev_uid")
 # @pytest.mark.skip(reason="an incompatible change has been made to this endpoint")
 class TestUploadRec:
     ROUTE = "/audio"
     CONTENT_TYPE = "multipart/form-data"
     DEFAULT_QID = 0
     DEFAULT_SID = 0
+    LONG_POLL_WAIT = 30
+    LARGE_FILE_COUNT = 3
+    LARGE_FILE_SIZE = 32 * 1024 * 1024
+    UPLOAD_MEMORY_CEILING = int(os.environ.get("UPLOAD_MEMORY_CEILING", 16 * 1024 * 1024))
 
     @pytest.fixture
     def unrec_qid(self, input_dir, mongodb):
@@ -1280,19 +1836,20 @@ class TestUploadRec:
         user_result = mongodb.Users.insert_one({"_id": dev_uid, "recordedAudios": []})
         yield user_result.inserted_id
         mongodb.Users.delete_one({"_id": user_result.inserted_id})
+        mongodb.UserRecordings.delete_many({"userId": user_result.inserted_id})
 
     @pytest.fixture
-    def upload_cleanup(self, mongodb, firebase_bucket, flask_app):
+    def upload_cleanup(self, mongodb, bucket, flask_app):
         yield
         audio_cursor = mongodb.UnprocessedAudio.find(None, {"_id": 1, "recType": 1})
         for audio_doc in audio_cursor:
             fid = audio_doc["_id"]
-            firebase_bucket.blob("/".join([flask_app.config["BLOB_ROOT"], audio_doc["recType"], fid])).delete()
+            bucket.blob(blob_path(flask_app.config["BLOB_ROOT"], audio_doc["recType"], fid)).delete()
         mongodb.UnprocessedAudio.delete_many({"_id": {"$exists": True}})
         audio_cursor = mongodb.Audio.find(None, {"_id": 1, "recType": 1})
         for audio_doc in audio_cursor:
             fid = audio_doc["_id"]
-            firebase_bucket.blob("/".join([flask_app.config["BLOB_ROOT"], audio_doc["recType"], fid])).delete()
+            bucket.blob(blob_path(flask_app.config["BLOB_ROOT"], audio_doc["recType"], fid)).delete()
         mongodb.Audio.delete_many({"_id": {"$exists": True}})
 
     @pytest.fixture
@@ -1368,6 +1925,23 @@ class TestUploadRec:
         for f in data["audio"]:
             f.close()
 
+    @pytest.fixture
+    def large_buzz_paths(self, tmp_path):
+        """Write WAV files of silence that are each larger than the memory ceiling for uploads."""
+        frame_rate = 16000
+        chunk = bytes(frame_rate * 2)  # One second of 16-bit mono silence
+        paths = []
+        for i in range(self.LARGE_FILE_COUNT):
+            path = tmp_path / f"large_{i}.wav"
+            with wave.open(str(path), "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(frame_rate)
+                for _ in range(self.LARGE_FILE_SIZE // len(chunk)):
+                    w.writeframes(chunk)
+            paths.append(str(path))
+        return paths
+
     def get_segmented_data(self, input_dir, unrec_sentence_ids, subdir_name):
         """Get the form arguments for a batch of audio files based on segmented questions."""
         data = {"audio": [], "recType": [], "qb_id": [], "sentenceId": []}
@@ -1381,22 +1955,44 @@ class TestUploadRec:
         return data
 
     def await_result(self, client, pointer, timeout=60, max_wait_time=2, wait_time=1):
-        total_wait_time = 0
-        status_response = client.get(f"/prescreen/{pointer}")
-        status_response_body = status_response.get_json()
-
-        while status_response_body["status"] != "finished":
-            status_response = client.get(f"/prescreen/{pointer}")
+        """Wait for a pre-screening job to end by long-polling its status."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"Ran out of patience: waited more than {timeout} seconds")
+            poll_wait = min(remaining, self.LONG_POLL_WAIT)
+            poll_start = time.monotonic()
+            status_response = client.get(f"/prescreen/{pointer}", query_string={"wait": poll_wait})
+            assert testutil.match_status(HTTPStatus.OK, status_response.status)
             status_response_body = status_response.get_json()
-            time.sleep(wait_time)
-            total_wait_time += wait_time
-            wait_time = min(wait_time * 2, max_wait_time)
-            if total_wait_time > timeout:
-                raise RuntimeError(f"Ran out of patience: {total_wait_time} > {timeout}")
             if status_response_body["status"] == "err":
                 raise RuntimeError(status_response_body["err"])
-
-        return status_response_body
+            if status_response_body["status"] == "finished":
+                return status_response_body
+            # A server that ignores the wait time answers right away, so back off instead of busy-polling it.
+            if time.monotonic() - poll_start < poll_wait:
+                time.sleep(min(wait_time, max(deadline - time.monotonic(), 0)))
+                wait_time = min(wait_time * 2, max_wait_time)
+
+    def await_results(self, client, pointers, timeout=60):
+        """Wait for a batch of pre-screening jobs to end by long-polling all of their statuses at once."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"Ran out of patience: waited more than {timeout} seconds")
+            status_response = client.get("/prescreen", query_string={
+                "pointers": pointers,
+                "wait": min(remaining, self.LONG_POLL_WAIT)
+            })
+            assert testutil.match_status(HTTPStatus.OK, status_response.status)
+            statuses = status_response.get_json()["results"]
+            for status in statuses.values():
+                if status["status"] == "err":
+                    raise RuntimeError(status["err"])
+            if all(status["status"] == "finished" for status in statuses.values()):
+                return [statuses[pointer] for pointer in pointers]
 
     # Test Case: Submitting a recording that should be guaranteed to pass the pre-screening.
     def test_success(self, client, mongodb, exact_data, upload_cleanup, user_id):
@@ -1410,6 +2006,26 @@ class TestUploadRec:
         for field in doc_required_fields:
             assert field in audio_doc
 
+    # Test Case: Long-polling the status of a pre-screening job. The server should respond as soon as the job ends
+    # rather than when the wait time is over, with the same payload as the regular status request.
+    def test_long_poll(self, client, mongodb, exact_data, upload_cleanup, user_id):
+        response = client.post(self.ROUTE, data=exact_data, content_type=self.CONTENT_TYPE)
+        assert testutil.match_status(HTTPStatus.ACCEPTED, response.status)
+        pointer = response.get_json()["prescreenPointers"][0]
+
+        wait_time = self.LONG_POLL_WAIT
+        start = time.monotonic()
+        status_response = client.get(f"/prescreen/{pointer}", query_string={"wait": wait_time})
+        elapsed = time.monotonic() - start
+        assert testutil.match_status(HTTPStatus.OK, status_response.status)
+        status_response_body = status_response.get_json()
+        assert status_response_body["status"] == "finished"
+        assert status_response_body["accepted"]
+        assert elapsed < wait_time
+
+        status_response = client.get(f"/prescreen/{pointer}")
+        assert status_response.get_json() == status_response_body
+
     # Test Case: Submitting a recording with audio distorted by environmental noise.
     def test_bad_env(self, client, mongodb, bad_env_data, upload_cleanup, user_id):
         response = client.post(self.ROUTE, data=bad_env_data, content_type=self.CONTENT_TYPE)
@@ -1461,6 +2077,41 @@ class TestUploadRec:
         assert rec["id"] == audio_doc["_id"]
         assert rec["recType"] == "buzz"
 
+    # Test Case: Submitting several buzz recordings that are each larger than the memory ceiling for uploads. The server
+    # should stream each file to storage in chunks, computing its duration and checksum along the way, instead of
+    # reading whole files into memory.
+    def test_large_streaming(self, mongodb, client, bucket, flask_app, large_buzz_paths, upload_cleanup, user_id):
+        checksums = {}
+        for path in large_buzz_paths:
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(block)
+            checksums[sha256.hexdigest()] = os.path.getsize(path)
+
+        files = [open(path, "rb") for path in large_buzz_paths]
+        data = {"audio": files, "recType": ["buzz"] * len(files)}
+        tracemalloc.start()
+        try:
+            response = client.post(self.ROUTE, data=data, content_type=self.CONTENT_TYPE)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            for f in files:
+                f.close()
+        assert testutil.match_status(HTTPStatus.ACCEPTED, response.status)
+        assert peak < self.UPLOAD_MEMORY_CEILING
+
+        for pointer in response.get_json()["prescreenPointers"]:
+            assert self.await_result(client, pointer)["accepted"]
+        audio_docs = list(mongodb.Audio.find({"userId": user_id, "recType": "buzz"}))
+        assert len(audio_docs) == len(large_buzz_paths)
+        for audio_doc in audio_docs:
+            assert "duration" in audio_doc
+            assert audio_doc["checksum"] in checksums
+            blob = bucket.get_blob(blob_path(flask_app.config["BLOB_ROOT"], "buzz", audio_doc["_id"]))
+            assert blob.size == checksums[audio_doc["checksum"]]
+
     # Test Case: Submitting a recording for an answer.
     def test_answer(self, mongodb, client, answer_data, upload_cleanup, user_id):
         doc_required_fields = ["userId", "recType", "expectedAnswer", "correct", "transcript", "duration"]
@@ -1482,6 +2133,24 @@ class TestUploadRec:
         assert rec["id"] == audio_doc["_id"]
         assert rec["recType"] == "answer"
 
+    # Test Case: Submitting a buzz recording and a recording for an answer to a server that keeps the recordings of each
+    # user in the UserRecordings collection, which came with the route for listing them.
+    @pytest.mark.parametrize("rec_type", ["buzz", "answer"])
+    def test_user_recordings(self, mongodb, client, flask_app, buzz_data, answer_data, upload_cleanup, user_id,
+                             rec_type):
+        testutil.require_route(flask_app, "/recordings")
+        data = buzz_data if rec_type == "buzz" else answer_data
+        response = client.post(self.ROUTE, data=data, content_type=self.CONTENT_TYPE)
+        assert testutil.match_status(HTTPStatus.ACCEPTED, response.status)
+        pointer = response.get_json()["prescreenPointers"][0]
+        assert self.await_result(client, pointer)["accepted"]
+
+        audio_doc = mongodb.Audio.find_one({"userId": user_id, "recType": rec_type})
+        rec = mongodb.UserRecordings.find_one({"userId": user_id})
+        assert rec["id"] == audio_doc["_id"]
+        assert rec["recType"] == rec_type
+        assert not mongodb.Users.find_one({"_id": user_id}).get("recordedAudios")
+
     # Test Case: Submitting a segmented recording for a segmented question.
     def test_segmented(self, mongodb, client, segmented_data, upload_cleanup, user_id):
         doc_required_fields = ["gentleVtt", "qb_id", "sentenceId", "userId", "recType", "duration"]
@@ -1495,6 +2164,23 @@ class TestUploadRec:
             for field in doc_required_fields:
                 assert field in audio_doc
 
+    # Test Case: Getting the statuses of every pre-screening job of a segmented recording in one request. Each status
+    # should be the same as the status given by the request for that job alone.
+    def test_segmented_bulk_status(self, mongodb, client, flask_app, segmented_data, upload_cleanup, user_id):
+        testutil.require_route(flask_app, "/prescreen")
+        response = client.post(self.ROUTE, data=segmented_data, content_type=self.CONTENT_TYPE)
+        assert testutil.match_status(HTTPStatus.ACCEPTED, response.status)
+        pointers = response.get_json()["prescreenPointers"]
+        assert len(pointers) == len(segmented_data["audio"])
+
+        self.await_results(client, pointers)
+        status_response = client.get("/prescreen", query_string={"pointers": pointers})
+        assert testutil.match_status(HTTPStatus.OK, status_response.status)
+        statuses = status_response.get_json()["results"]
+        assert sorted(statuses.keys()) == sorted(pointers)
+        for pointer in pointers:
+            assert statuses[pointer] == client.get(f"/prescreen/{pointer}").get_json()
+
     # Test Case: Submitting a segmented recording of the speaker reading a paragraph from the "Lorem ipsum" Wikipedia
     # article for a segmented question.
     # Source: https://en.wikipedia.org/wiki/Lorem_ipsum
@@ -1549,12 +2235,12 @@ class TestOwnProfile:
         yield profile
         mongodb.Users.delete_one({"_id": result.inserted_id})
 
-    def test_create(self, client, mongodb, profile_args, dev_uid, api_spec):
+    def test_create(self, client, mongodb, profile_args, dev_uid, validators):
         response = client.post(self.ROUTE, json=profile_args)
         assert testutil.match_status(HTTPStatus.CREATED, response.status)
         profile = mongodb.Users.find_one({"_id": dev_uid})
         assert profile
-        validate(profile, api_spec.get_schema("User", resolve_references=True))
+        validators.for_schema("User").validate(profile)
 
     def test_get(self, client, user_profile):
         required_fields = [
@@ -1578,6 +2264,21 @@ class TestOwnProfile:
         for field in required_fields:
             assert field in profile
 
+    # Test Case: Getting only some of the fields of the profile.
+    def test_get_fields(self, client, user_profile):
+        fields = ["username", "pfp", "ratings"]
+        response = client.get(self.ROUTE, query_string={"fields": fields})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        profile = response.get_json()
+        assert set(profile.keys()) - {"_id"} == set(fields)
+        for field in fields:
+            assert profile[field] == user_profile[field]
+
+    # Test Case: Asking for a field that is not part of a profile.
+    def test_get_fields_unknown(self, client, user_profile):
+        response = client.get(self.ROUTE, query_string={"fields": ["username", "Foo"]})
+        assert testutil.match_status(HTTPStatus.BAD_REQUEST, response.status)
+
     def test_update(self, client, mongodb, user_profile, profile_update_args):
         response = client.patch(self.ROUTE, json=profile_update_args)
         assert testutil.match_status(HTTPStatus.OK, response.status)
@@ -1591,9 +2292,10 @@ class TestOwnProfile:
         assert not mongodb.Users.find_one({"_id": user_profile["_id"]})
 
 
-@pytest.mark.usefixtures("client", "mongodb", "flask_app")
+@pytest.mark.usefixtures("client", "mongodb", "flask_app", "clear_caches")
 class TestHLSGet:
     ROUTE = "/hls"
+    CACHE_NAME = "vtt"
 
     @pytest.fixture
     def doc_setup(self, mongodb, flask_app, blob_file):
@@ -1635,10 +2337,51 @@ class TestHLSGet:
         assert response.content_type == "application/octet-stream"
         assert response.get_data() == b'The quick brown fox jumps over the lazy dog.'
 
+    # Test Case: The response includes the validators needed for conditional requests.
+    def test_get_vtt_validators(self, client, doc_setup, full_route_vtt):
+        response = client.get(full_route_vtt)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.headers.get("ETag")
+        assert response.last_modified is not None
+
+    # Test Case: Requesting a VTT that the client already has, by its entity tag.
+    def test_get_vtt_if_none_match(self, client, doc_setup, full_route_vtt):
+        etag = client.get(full_route_vtt).headers["ETag"]
+        response = client.get(full_route_vtt, headers={"If-None-Match": etag})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        assert response.get_data() == b''
+        assert response.headers["ETag"] == etag
+
+    # Test Case: Requesting a VTT that the client already has, by its modification date.
+    def test_get_vtt_if_modified_since(self, client, doc_setup, full_route_vtt):
+        last_modified = client.get(full_route_vtt).headers["Last-Modified"]
+        response = client.get(full_route_vtt, headers={"If-Modified-Since": last_modified})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        assert response.get_data() == b''
+
+    # Test Case: Requesting a VTT with an entity tag that does not match. The whole VTT should be sent.
+    def test_get_vtt_etag_mismatch(self, client, doc_setup, full_route_vtt):
+        response = client.get(full_route_vtt, headers={"If-None-Match": '"outdated"'})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.get_data() == b'The quick brown fox jumps over the lazy dog.'
 
-@pytest.mark.usefixtures("client", "mongodb", "api_spec", "dev_uid")
+    # Test Case: Requesting the same VTT twice. The second request should be served from the cache.
+    def test_get_vtt_cache_hit(self, client, flask_app, doc_setup, full_route_vtt):
+        testutil.require_route(flask_app, "/stats/cache")
+        before = testutil.get_cache_stats(client, self.CACHE_NAME)
+        for _ in range(2):
+            response = client.get(full_route_vtt)
+            assert response.get_data() == b'The quick brown fox jumps over the lazy dog.'
+        after = testutil.get_cache_stats(client, self.CACHE_NAME)
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+        assert 0 < after["size"] <= after["maxSize"]
+
+
+@pytest.mark.usefixtures("client", "mongodb", "api_spec", "dev_uid", "clear_caches")
 class TestOtherProfile:
     ROUTE = "/profile"
+    CACHE_NAME = "profile"
 
     @pytest.fixture
     def profile_args(self, mongodb):
@@ -1687,6 +2430,103 @@ class TestOtherProfile:
             assert field in other_profile
             assert profile[field] == other_profile[field]
 
+    # Test Case: Getting only some of the fields of another user's profile.
+    def test_get_fields(self, client, other_profile):
+        fields = ["username", "pfp", "ratings"]
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        response = client.get(full_route, query_string={"fields": fields})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        profile = response.get_json()
+        assert set(profile.keys()) - {"_id"} == set(fields)
+        for field in fields:
+            assert profile[field] == other_profile[field]
+
+    # Test Case: Getting the same profile twice, the second time with a projection. The second request should be served
+    # from the cache.
+    def test_cache_hit(self, client, flask_app, other_profile):
+        testutil.require_route(flask_app, "/stats/cache")
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        before = testutil.get_cache_stats(client, self.CACHE_NAME)
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.get(full_route, query_string={"fields": ["username"]})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.get_json()["username"] == other_profile["username"]
+        after = testutil.get_cache_stats(client, self.CACHE_NAME)
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+        assert 0 < after["size"] <= after["maxSize"]
+
+    # Test Case: Getting a cached profile after it has been updated. The update should be visible immediately.
+    def test_cache_invalidate_update(self, client, flask_app, mongodb, admin_profile, other_profile):
+        testutil.require_route(flask_app, "/stats/cache")
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.patch(full_route, json={"pfp": [4, 5, 6]})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.get_json()["pfp"] == [4, 5, 6]
+
+    # Test Case: Getting a cached profile after its owner has updated it through their own profile route.
+    def test_cache_invalidate_own_update(self, client, flask_app, admin_profile):
+        testutil.require_route(flask_app, "/stats/cache")
+        full_route = "/".join([self.ROUTE, admin_profile["username"]])
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.patch(self.ROUTE, json={"pfp": [4, 5, 6]})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        assert response.get_json()["pfp"] == [4, 5, 6]
+
+    # Test Case: Getting a cached profile after game results have changed the user's ratings and statistics. The
+    # profile should match the user's live document.
+    def test_cache_invalidate_game_results(self, client, flask_app, mongodb, other_profile, socket_server_key):
+        testutil.require_route(flask_app, "/stats/cache")
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.put(TestProcessGameResults.ROUTE, json={
+            "mode": "competitive",
+            "category": "literature",
+            "users": {
+                other_profile["username"]: {
+                    "questionStats": {
+                        "played": 10,
+                        "buzzed": 5,
+                        "correct": 2,
+                        "cumulativeProgressOnBuzz": {
+                            "percentQuestionRead": 2.5,
+                            "numSentences": 10
+                        }
+                    },
+                    "finished": True,
+                    "won": True
+                }
+            }
+        }, headers={"Authorization": socket_server_key})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        live_profile = mongodb.Users.find_one({"_id": other_profile["_id"]})
+        profile = response.get_json()
+        for field in profile:
+            assert profile[field] == live_profile[field]
+
+    # Test Case: Getting a cached profile after it has been deleted.
+    def test_cache_invalidate_delete(self, client, flask_app, mongodb, admin_profile, other_profile):
+        testutil.require_route(flask_app, "/stats/cache")
+        full_route = "/".join([self.ROUTE, other_profile["username"]])
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.delete(full_route)
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response = client.get(full_route)
+        assert testutil.match_status(HTTPStatus.NOT_FOUND, response.status)
+
     def test_update(self, client, mongodb, admin_profile, other_profile, profile_update_args):
         full_route = "/".join([self.ROUTE, other_profile["username"]])
         response = client.patch(full_route, json=profile_update_args)
@@ -1707,6 +2547,11 @@ class TestVoting:
     UPVOTE_ROUTE = "/upvote"
     DOWNVOTE_ROUTE = "/downvote"
 
+    BULK_ROUTE = "/votes"
+    NUM_BULK_DOCS = 5
+    NUM_THREADS = 10
+    VOTES_PER_THREAD = 20
+
     @pytest.fixture
     def user_profile(self, mongodb):
         result = mongodb.Users.insert_one({
@@ -1715,12 +2560,31 @@ class TestVoting:
         })
         yield
         mongodb.Users.delete_one({"_id": "test"})
+        mongodb.Votes.delete_many({"userId": "test"})
 
     @pytest.fixture
     def audio_doc(self, mongodb):
         mongodb.Audio.insert_one({"_id": "test_doc"})
         yield
         mongodb.Audio.delete_one({"_id": "test_doc"})
+        mongodb.Votes.delete_many({"audioId": "test_doc"})
+
+    @pytest.fixture
+    def audio_docs(self, mongodb):
+        audio_ids = [testutil.generate_audio_id() for _ in range(self.NUM_BULK_DOCS)]
+        mongodb.Audio.insert_many([{"_id": audio_id} for audio_id in audio_ids])
+        yield audio_ids
+        mongodb.Audio.delete_many({"_id": {"$in": audio_ids}})
+        mongodb.Votes.delete_many({"audioId": {"$in": audio_ids}})
+
+    @pytest.fixture
+    def votes_collection(self, flask_app):
+        """Skip the test unless the server keeps votes in the Votes collection, which came with the bulk vote route."""
+        testutil.require_route(flask_app, self.BULK_ROUTE, "PATCH")
+
+    @staticmethod
+    def get_votes(mongodb, user_id, audio_id):
+        return list(mongodb.Votes.find({"userId": user_id, "audioId": audio_id}))
 
     def test_upvote(self, client, mongodb, audio_doc, user_profile):
         response = client.patch(f"{self.UPVOTE_ROUTE}/test_doc", json={"userId": "test"})
@@ -1789,3 +2653,144 @@ class TestVoting:
         user = mongodb.Users.find_one({"_id": "test"})
         assert user["recVotes"][0]["vote"] == -1
         assert len(user["recVotes"]) == 1
+
+    # Test Cases: Sequences of votes by one user on one recording, with the votes kept in the Votes collection. There
+    # should be one vote document with the last vote, and the counters of the recording should only count that vote.
+    @pytest.mark.parametrize("votes", [[1], [-1], [1, 1], [-1, -1], [-1, 1], [1, -1]],
+                             ids=["upvote", "downvote", "upvote_twice", "downvote_twice", "downvote_to_upvote",
+                                  "upvote_to_downvote"])
+    def test_votes_collection(self, client, mongodb, audio_doc, user_profile, votes_collection, votes):
+        for vote in votes:
+            route = self.UPVOTE_ROUTE if vote == 1 else self.DOWNVOTE_ROUTE
+            response = client.patch(f"{route}/test_doc", json={"userId": "test"})
+            assert response.status_code == HTTPStatus.OK
+
+        audio = mongodb.Audio.find_one({"_id": "test_doc"})
+        assert audio.get("upvotes", 0) == (1 if votes[-1] == 1 else 0)
+        assert audio.get("downvotes", 0) == (1 if votes[-1] == -1 else 0)
+        vote_docs = self.get_votes(mongodb, "test", "test_doc")
+        assert len(vote_docs) == 1
+        assert vote_docs[0]["vote"] == votes[-1]
+
+    # Test Case: Voting on several recordings at once, then changing one of the votes in another batch.
+    def test_bulk(self, client, mongodb, audio_docs, user_profile, votes_collection):
+        arguments = [{"audioId": audio_id, "vote": 1 if i % 2 == 0 else -1} for i, audio_id in enumerate(audio_docs)]
+        response = client.patch(self.BULK_ROUTE, json={"userId": "test", "arguments": arguments})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["total"] == len(arguments)
+        assert response_body["successes"] == len(arguments)
+
+        response = client.patch(self.BULK_ROUTE, json={"userId": "test", "arguments": [
+            {"audioId": audio_docs[0], "vote": -1}
+        ]})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        arguments[0]["vote"] = -1
+        for argument in arguments:
+            audio = mongodb.Audio.find_one({"_id": argument["audioId"]})
+            assert audio.get("upvotes", 0) == (1 if argument["vote"] == 1 else 0)
+            assert audio.get("downvotes", 0) == (1 if argument["vote"] == -1 else 0)
+            votes = self.get_votes(mongodb, "test", argument["audioId"])
+            assert len(votes) == 1
+            assert votes[0]["vote"] == argument["vote"]
+
+    # Test Case: A recording that does not exist in a bulk vote. It should count as a failure and leave no vote.
+    def test_bulk_missing(self, client, mongodb, audio_docs, user_profile, votes_collection):
+        missing_id = testutil.generate_audio_id()
+        arguments = [{"audioId": audio_id, "vote": 1} for audio_id in [*audio_docs, missing_id]]
+        response = client.patch(self.BULK_ROUTE, json={"userId": "test", "arguments": arguments})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["total"] == len(arguments)
+        assert response_body["successes"] == len(audio_docs)
+        assert not self.get_votes(mongodb, "test", missing_id)
+
+    # Test Case: Several threads switching one user's vote on one recording between upvotes and downvotes at the same
+    # time. There should be exactly one vote document, and the counters should agree with its vote.
+    def test_concurrent(self, flask_app, mongodb, audio_doc, user_profile, votes_collection):
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                with flask_app.test_client() as worker_client:
+                    for _ in range(self.VOTES_PER_THREAD):
+                        route = rng.choice([self.UPVOTE_ROUTE, self.DOWNVOTE_ROUTE])
+                        response = worker_client.patch(f"{route}/test_doc", json={"userId": "test"})
+                        assert response.status_code == HTTPStatus.OK
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.NUM_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+
+        vote_docs = self.get_votes(mongodb, "test", "test_doc")
+        assert len(vote_docs) == 1
+        audio = mongodb.Audio.find_one({"_id": "test_doc"})
+        assert audio.get("upvotes", 0) == (1 if vote_docs[0]["vote"] == 1 else 0)
+        assert audio.get("downvotes", 0) == (1 if vote_docs[0]["vote"] == -1 else 0)
+
+
+@pytest.mark.usefixtures("client", "mongodb", "dev_uid")
+class TestGetRecordings:
+    ROUTE = "/recordings"
+    NUM_RECORDINGS = 25
+    PAGE_SIZE = 10
+
+    @pytest.fixture
+    def recordings_route(self, flask_app):
+        """Skip the test unless the server has the route for listing recordings, which came with UserRecordings."""
+        testutil.require_route(flask_app, self.ROUTE)
+
+    @pytest.fixture
+    def user_recordings(self, mongodb, dev_uid):
+        other_uid = testutil.generate_uid()
+        mongodb.Users.insert_many([{"_id": dev_uid}, {"_id": other_uid}])
+        recording_docs = [
+            {"userId": dev_uid, "id": testutil.generate_audio_id(), "recType": random.choice(["normal", "buzz"])}
+            for _ in range(self.NUM_RECORDINGS)
+        ]
+        recording_docs.append({"userId": other_uid, "id": testutil.generate_audio_id(), "recType": "normal"})
+        mongodb.UserRecordings.insert_many(recording_docs)
+        yield [doc["id"] for doc in recording_docs if doc["userId"] == dev_uid]
+        mongodb.Users.delete_many({"_id": {"$in": [dev_uid, other_uid]}})
+        mongodb.UserRecordings.delete_many({"userId": {"$in": [dev_uid, other_uid]}})
+
+    @pytest.fixture
+    def user_profile(self, mongodb, dev_uid):
+        mongodb.Users.insert_one({"_id": dev_uid})
+        yield
+        mongodb.Users.delete_one({"_id": dev_uid})
+
+    # Test Case: Walking through the user's recordings one page at a time. The pages should list every recording of the
+    # user exactly once, in the order they were made, and no recording of another user.
+    def test_pagination(self, client, recordings_route, user_recordings):
+        recording_ids = []
+        cursor = None
+        while True:
+            query_string = {"size": self.PAGE_SIZE}
+            if cursor:
+                query_string["cursor"] = cursor
+            response = client.get(self.ROUTE, query_string=query_string)
+            assert testutil.match_status(HTTPStatus.OK, response.status)
+            response_body = response.get_json()
+            assert len(response_body["results"]) <= self.PAGE_SIZE
+            for recording in response_body["results"]:
+                assert "recType" in recording
+                recording_ids.append(recording["id"])
+            cursor = response_body.get("next")
+            if not cursor:
+                break
+        assert recording_ids == user_recordings
+
+    # Test Case: A user with no recordings.
+    def test_empty(self, client, recordings_route, user_profile):
+        response = client.get(self.ROUTE, query_string={"size": self.PAGE_SIZE})
+        assert testutil.match_status(HTTPStatus.OK, response.status)
+        response_body = response.get_json()
+        assert response_body["results"] == []
+        assert not response_body.get("next")
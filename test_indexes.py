@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+import indexes
+import testutil
+
+# For testing that the server applies the indexes in indexes.py when it starts and that the queries it runs for its
+# endpoints use them. Each entry of ENDPOINT_REQUESTS is a request as (method, path, arguments of the test client). The
+# "audio_file" argument uploads a file from the input directory, and "socket_key" authorizes the request as the socket
+# server. Every command with a query filter that the server sends to MongoDB while handling a request is explained, and
+# a command that would need a collection scan fails the test for its endpoint.
+
+AUDIO_ID = "QueryPlansAudio"
+USER_ID = "QueryPlansUser"
+USERNAME = "QueryPlansUser"
+MISSING_QB_ID = -1
+
+ENDPOINT_REQUESTS = [
+    ("GET", "/answer", {"query_string": {"qid": 0, "a": "Foo"}}),
+    ("GET", "/question", {}),
+    ("GET", "/question", {"query_string": {"category": "literature"}}),
+    ("GET", "/question/unrec", {}),
+    ("GET", "/question/unrec", {"query_string": {"difficultyType": 0, "batchSize": 3}}),
+    ("GET", "/profile/Foo", {}),
+    ("GET", "/recordings", {}),
+    *[("GET", "/leaderboard", {"query_string": {"category": category}}) for category in indexes.CATEGORIES],
+    ("PATCH", f"/upvote/{AUDIO_ID}", {"json": {"userId": USER_ID}}),
+    ("PATCH", f"/downvote/{AUDIO_ID}", {"json": {"userId": USER_ID}}),
+    ("PATCH", "/votes", {"json": {"userId": USER_ID, "arguments": [{"audioId": AUDIO_ID, "vote": 1}]}}),
+    ("PUT", "/game_results", {"socket_key": True, "json": {
+        "mode": "casual",
+        "category": "literature",
+        "users": {
+            USERNAME: {
+                "questionStats": {
+                    "played": 1,
+                    "buzzed": 1,
+                    "correct": 1,
+                    "cumulativeProgressOnBuzz": {
+                        "percentQuestionRead": 1.0,
+                        "numSentences": 1
+                    }
+                },
+                "finished": True,
+                "won": True
+            }
+        }
+    }}),
+    ("POST", "/audio", {"audio_file": "test.wav", "content_type": "multipart/form-data",
+                        "data": {"recType": "normal", "qb_id": MISSING_QB_ID, "sentenceId": 0}})
+]
+
+
+@pytest.mark.usefixtures("mongodb_client", "app_factory")
+class TestIndexSpec:
+    @pytest.fixture(scope="class")
+    def fresh_database(self, mongodb_client, app_factory, db_name):
+        """Start a server against an empty database, and get that database."""
+        name = f"{db_name}Indexes"
+        mongodb_client.drop_database(name)
+        app_factory(DATABASE=name)
+        yield mongodb_client.get_database(name)
+        mongodb_client.drop_database(name)
+
+    # Test Case: Every index in the specification exists once a server has started against an empty database.
+    @pytest.mark.parametrize("collection_name", indexes.INDEXES.keys())
+    def test_applied(self, fresh_database, collection_name):
+        index_info = fresh_database.get_collection(collection_name).index_information()
+        for model in indexes.INDEXES[collection_name]:
+            document = model.document
+            assert document["name"] in index_info
+            assert list(index_info[document["name"]]["key"]) == list(document["key"].items())
+
+    # Test Case: Starting another server against the same database does not fail or change any index.
+    def test_idempotent(self, fresh_database, app_factory):
+        before = {name: fresh_database.get_collection(name).index_information() for name in indexes.INDEXES}
+        app_factory(DATABASE=fresh_database.name)
+        after = {name: fresh_database.get_collection(name).index_information() for name in indexes.INDEXES}
+        assert before == after
+
+
+@pytest.mark.usefixtures("mongodb", "flask_app", "recorded_client", "command_recorder")
+class TestQueryPlans:
+    @pytest.fixture
+    def write_docs(self, mongodb):
+        """Insert a recording and a user for the requests that write, so that they reach their lookups."""
+        mongodb.Audio.insert_one({"_id": AUDIO_ID, "qb_id": MISSING_QB_ID, "sentenceId": 0, "recType": "normal"})
+        mongodb.Users.insert_one({"_id": USER_ID, "username": USERNAME, "recVotes": []})
+        yield
+        mongodb.Audio.delete_one({"_id": AUDIO_ID})
+        mongodb.Users.delete_one({"_id": USER_ID})
+        mongodb.Votes.delete_many({"audioId": AUDIO_ID})
+
+    @pytest.mark.parametrize("method, path, arguments", ENDPOINT_REQUESTS,
+                             ids=[f"{entry[0]} {entry[1]}-{i}" for i, entry in enumerate(ENDPOINT_REQUESTS)])
+    def test_no_collscan(self, mongodb, flask_app, recorded_client, command_recorder, write_docs, input_dir,
+                         socket_server_key, method, path, arguments):
+        testutil.require_route(flask_app, path, method)
+        arguments = dict(arguments)
+        if arguments.pop("socket_key", False):
+            arguments["headers"] = {"Authorization": socket_server_key}
+        audio_file = arguments.pop("audio_file", None)
+        command_recorder.clear()
+        if audio_file:
+            with open(os.path.join(input_dir, audio_file), "rb") as audio:
+                arguments["data"] = {**arguments["data"], "audio": audio}
+                recorded_client.open(path, method=method, **arguments)
+        else:
+            recorded_client.open(path, method=method, **arguments)
+        commands = command_recorder.queries()
+        assert commands, f"{method} {path} sent no command with a query filter"
+        for command in commands:
+            stages = testutil.get_plan_stages(testutil.explain_command(mongodb, command))
+            assert "COLLSCAN" not in stages, f"{method} {path} scans a collection for {command}"
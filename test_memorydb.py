@@ -0,0 +1,429 @@
+from datetime import datetime, timezone
+
+import bson
+import pytest
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+import memorydb
+
+# For testing that the in-process stand-in for MongoDB in memorydb.py behaves like MongoDB. Every other testing module
+# relies on it when MONGODB_BACKEND is "memory", so these tests do not need a server.
+
+
+@pytest.fixture
+def database():
+    return memorydb.MemoryClient().get_database("test")
+
+
+@pytest.fixture
+def collection(database):
+    return database.get_collection("test")
+
+
+class TestQuery:
+    @pytest.fixture
+    def docs(self, collection):
+        docs = [
+            {"_id": 1, "n": 1, "tags": ["a", "b"], "ratings": {"all": 5}, "recordings": [{"id": "x", "wer": 0.1}]},
+            {"_id": 2, "n": 2, "tags": ["b"], "ratings": {"all": 3}, "recordings": [{"id": "y", "wer": 0.5}]},
+            {"_id": 3, "n": 3.5, "tags": [], "name": "Foo"},
+            {"_id": 4, "n": "3", "name": None}
+        ]
+        collection.insert_many(docs)
+        return docs
+
+    def find_ids(self, collection, query):
+        return [doc["_id"] for doc in collection.find(query)]
+
+    # Test Cases: Each query operator, including comparisons that only match values of the same type.
+    @pytest.mark.parametrize("query, expected_ids", [
+        ({"n": 1}, [1]),
+        ({"n": {"$eq": 2}}, [2]),
+        ({"n": {"$ne": 1}}, [2, 3, 4]),
+        ({"n": {"$in": [1, 3.5]}}, [1, 3]),
+        ({"n": {"$nin": [1, 3.5]}}, [2, 4]),
+        ({"n": {"$gt": 1}}, [2, 3]),
+        ({"n": {"$gte": 2, "$lt": 4}}, [2, 3]),
+        ({"n": {"$lte": "3"}}, [4]),
+        ({"name": {"$exists": True}}, [3, 4]),
+        ({"name": {"$exists": False}}, [1, 2]),
+        ({"name": None}, [1, 2, 4]),
+        ({"tags": "b"}, [1, 2]),
+        ({"tags": ["b"]}, [2]),
+        ({"tags": {"$size": 0}}, [3]),
+        ({"tags": {"$all": ["a", "b"]}}, [1]),
+        ({"recordings": {"$elemMatch": {"wer": {"$lt": 0.3}}}}, [1]),
+        ({"recordings.id": "y"}, [2]),
+        ({"ratings.all": {"$gt": 4}}, [1]),
+        ({"n": {"$not": {"$gt": 1}}}, [1, 4]),
+        ({"name": {"$regex": "^F"}}, [3]),
+        ({"$or": [{"n": 1}, {"n": 2}]}, [1, 2]),
+        ({"$and": [{"tags": "b"}, {"n": {"$gt": 1}}]}, [2]),
+        ({"$nor": [{"n": 1}, {"name": {"$exists": True}}]}, [2])
+    ])
+    def test_operator(self, collection, docs, query, expected_ids):
+        assert self.find_ids(collection, query) == expected_ids
+
+    # Test Case: An operator that MongoDB does not have.
+    def test_unknown_operator(self, collection, docs):
+        with pytest.raises(OperationFailure):
+            collection.find_one({"n": {"$foo": 1}})
+
+    # Test Case: Changing a returned document does not change the stored one.
+    def test_copies(self, collection, docs):
+        doc = collection.find_one({"_id": 1})
+        doc["tags"].append("c")
+        assert collection.find_one({"_id": 1})["tags"] == ["a", "b"]
+
+    # Test Case: Values of different types sort in the BSON type order, whatever the order of insertion.
+    @pytest.mark.parametrize("direction", [1, -1])
+    def test_sort_type_order(self, collection, direction):
+        values = [
+            None,
+            1,
+            2.5,
+            "a",
+            {"a": 1},
+            [5],
+            b"a",
+            bson.ObjectId(),
+            False,
+            datetime(2021, 1, 1, tzinfo=timezone.utc)
+        ]
+        collection.insert_many([{"_id": i, "value": value} for i, value in reversed(list(enumerate(values)))])
+        # An array sorts by one of its elements, so [5] goes with the numbers, after 2.5.
+        expected_ids = [0, 1, 2, 5, 3, 4, 6, 7, 8, 9]
+        if direction < 0:
+            expected_ids.reverse()
+        assert [doc["_id"] for doc in collection.find().sort("value", direction)] == expected_ids
+
+    # Test Case: Sorting arrays. An array sorts by its smallest element in ascending order and by its largest in
+    # descending order, so [1, 5] comes first either way.
+    @pytest.mark.parametrize("direction", [1, -1])
+    def test_sort_arrays(self, collection, direction):
+        collection.insert_many([{"_id": 1, "value": [3]}, {"_id": 2, "value": [1, 5]}])
+        assert [doc["_id"] for doc in collection.find().sort("value", direction)] == [2, 1]
+
+    # Test Case: Skipping and limiting through the positional parameters of find(), which come in the same order as in
+    # pymongo.
+    def test_find_positional(self, collection, docs):
+        assert [doc["_id"] for doc in collection.find({}, None, 1, 2)] == [2, 3]
+
+    # Test Case: Comparing datetimes.
+    def test_datetime(self, collection):
+        collection.insert_many([
+            {"_id": 1, "expiry": datetime(2021, 1, 1)},
+            {"_id": 2, "expiry": datetime(2022, 1, 1)}
+        ])
+        assert self.find_ids(collection, {"expiry": {"$lt": datetime(2021, 6, 1)}}) == [1]
+        assert [doc["_id"] for doc in collection.find().sort("expiry", -1)] == [2, 1]
+
+    # Test Case: Storing and querying datetimes with and without a time zone. BSON keeps datetimes as naive UTC to the
+    # millisecond, so both kinds compare with each other.
+    def test_datetime_aware(self, collection):
+        expiry = datetime(2021, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+        collection.insert_one({"_id": 1, "expiry": expiry})
+        assert collection.find_one({"_id": 1})["expiry"] == datetime(2021, 1, 1, 12, 0, 0, 123000)
+        assert self.find_ids(collection, {"expiry": {"$lt": datetime(2021, 6, 1)}}) == [1]
+        assert self.find_ids(collection, {"expiry": {"$lt": datetime(2021, 6, 1, tzinfo=timezone.utc)}}) == [1]
+        assert self.find_ids(collection, {"expiry": expiry}) == [1]
+
+    # Test Case: Values that BSON does not keep as they are. Tuples come back as lists, large integers as Int64, which
+    # still equals the int, and keys must be strings.
+    def test_bson_types(self, collection):
+        collection.insert_one({"_id": 1, "pair": (1, 2), "n": bson.Int64(5)})
+        doc = collection.find_one({"_id": 1})
+        assert doc["pair"] == [1, 2]
+        assert self.find_ids(collection, {"n": 5}) == [1]
+        assert self.find_ids(collection, {"n": {"$gte": 5}}) == [1]
+        with pytest.raises(bson.errors.InvalidDocument):
+            collection.insert_one({"_id": 2, "counts": {1: "a"}})
+
+
+class TestUpdate:
+    @pytest.fixture
+    def question(self, collection):
+        doc = {"_id": 1, "recordings": [{"id": "x", "votes": 0}, {"id": "y", "votes": 0}]}
+        collection.insert_one(doc)
+        return doc
+
+    # Test Case: Updating the array element that the filter matched through a dotted path.
+    def test_positional(self, collection, question):
+        result = collection.update_one({"_id": 1, "recordings.id": "y"}, {"$inc": {"recordings.$.votes": 1}})
+        assert result.modified_count == 1
+        assert collection.find_one({"_id": 1})["recordings"] == [{"id": "x", "votes": 0}, {"id": "y", "votes": 1}]
+
+    # Test Case: Updating the array element that the filter matched through $elemMatch.
+    def test_positional_elem_match(self, collection, question):
+        collection.update_one({"recordings": {"$elemMatch": {"id": "x"}}}, {"$set": {"recordings.$.votes": 5}})
+        assert collection.find_one({"_id": 1})["recordings"][0]["votes"] == 5
+
+    # Test Case: A positional update whose filter does not say which element to update.
+    def test_positional_no_match(self, collection, question):
+        with pytest.raises(OperationFailure):
+            collection.update_one({"_id": 1}, {"$set": {"recordings.$.votes": 1}})
+
+    # Test Case: Each update operator.
+    def test_operators(self, collection):
+        collection.insert_one({"_id": 1, "n": 2, "low": 5, "high": 5, "tags": ["a"], "old": True})
+        collection.update_one({"_id": 1}, {
+            "$inc": {"n": 3},
+            "$mul": {"m": 2},
+            "$min": {"low": 1},
+            "$max": {"high": 1},
+            "$push": {"tags": {"$each": ["b", "c"]}},
+            "$addToSet": {"set": "a"},
+            "$unset": {"old": ""},
+            "$set": {"nested.field": 1}
+        })
+        collection.update_one({"_id": 1}, {"$pull": {"tags": "b"}, "$pop": {"set": 1}})
+        assert collection.find_one({"_id": 1}) == {
+            "_id": 1, "n": 5, "m": 0, "low": 1, "high": 5, "tags": ["a", "c"], "set": [], "nested": {"field": 1}
+        }
+
+    # Test Case: An update operator that MongoDB does not have.
+    def test_unknown_operator(self, collection, question):
+        with pytest.raises(OperationFailure):
+            collection.update_one({"_id": 1}, {"$foo": {"n": 1}})
+
+    # Test Case: Upserting a document. It should inherit the equality fields of the filter and the $setOnInsert fields.
+    def test_upsert(self, collection):
+        result = collection.update_one({"userId": "u", "audioId": "a", "n": {"$gt": 0}},
+                                       {"$set": {"vote": 1}, "$setOnInsert": {"created": True}}, upsert=True)
+        assert result.upserted_id is not None
+        doc = collection.find_one({"_id": result.upserted_id}, {"_id": 0})
+        assert doc == {"userId": "u", "audioId": "a", "vote": 1, "created": True}
+
+        result = collection.update_one({"userId": "u", "audioId": "a"},
+                                       {"$set": {"vote": -1}, "$setOnInsert": {"created": False}}, upsert=True)
+        assert result.upserted_id is None and result.modified_count == 1
+        assert collection.find_one({"userId": "u"})["created"] is True
+
+    # Test Case: Upserting through find_one_and_update, returning the document before and after the update.
+    def test_find_one_and_update_upsert(self, collection):
+        before = collection.find_one_and_update({"_id": "a"}, {"$inc": {"n": 1}}, upsert=True)
+        assert before is None
+        after = collection.find_one_and_update({"_id": "a"}, {"$inc": {"n": 1}}, upsert=True,
+                                               return_document=ReturnDocument.AFTER)
+        assert after == {"_id": "a", "n": 2}
+
+    # Test Case: Replacing a document, and upserting a replacement.
+    def test_replace_upsert(self, collection):
+        collection.replace_one({"_id": 1}, {"n": 1}, upsert=True)
+        collection.replace_one({"_id": 1}, {"m": 2})
+        assert collection.find_one({"_id": 1}) == {"_id": 1, "m": 2}
+
+
+class TestUniqueIndex:
+    @pytest.fixture
+    def votes(self, collection):
+        collection.create_index([("userId", 1), ("audioId", 1)], unique=True)
+        collection.insert_one({"_id": 1, "userId": "u", "audioId": "a"})
+        return collection
+
+    # Test Case: Inserting a second document with the same key.
+    def test_insert(self, votes):
+        with pytest.raises(DuplicateKeyError):
+            votes.insert_one({"_id": 2, "userId": "u", "audioId": "a"})
+        assert votes.count_documents({}) == 1
+
+    # Test Case: An update that would give a document the key of another one. Neither document should change.
+    def test_update(self, votes):
+        votes.insert_one({"_id": 2, "userId": "u", "audioId": "b"})
+        with pytest.raises(DuplicateKeyError):
+            votes.update_one({"_id": 2}, {"$set": {"audioId": "a"}})
+        assert votes.find_one({"_id": 2})["audioId"] == "b"
+
+    # Test Case: Inserting several documents where one has the key of another. As in pymongo, the error is a
+    # BulkWriteError, and an unordered insert still inserts the documents after the duplicate.
+    @pytest.mark.parametrize("ordered, expected_count", [(True, 2), (False, 3)])
+    def test_insert_many(self, votes, ordered, expected_count):
+        docs = [{"userId": "u", "audioId": "b"}, {"userId": "u", "audioId": "a"}, {"userId": "u", "audioId": "c"}]
+        with pytest.raises(BulkWriteError) as error:
+            votes.insert_many(docs, ordered=ordered)
+        assert error.value.details["writeErrors"][0]["index"] == 1
+        assert error.value.details["writeErrors"][0]["code"] == 11000
+        assert all("_id" in doc for doc in docs)
+        assert votes.count_documents({}) == expected_count
+
+    # Test Case: Deleting a document frees its key.
+    def test_delete(self, votes):
+        votes.delete_one({"_id": 1})
+        votes.insert_one({"_id": 2, "userId": "u", "audioId": "a"})
+
+    # Test Case: Creating a unique index over documents that already have duplicate keys.
+    def test_create_on_duplicates(self, collection):
+        collection.insert_many([{"name": "Foo"}, {"name": "Foo"}])
+        with pytest.raises(DuplicateKeyError):
+            collection.create_index("name", unique=True)
+        assert "name_1" not in collection.index_information()
+
+    # Test Case: A sparse unique index leaves out documents that lack the field.
+    def test_sparse(self, collection):
+        collection.create_index("name", unique=True, sparse=True)
+        collection.insert_many([{"n": 1}, {"n": 2}])
+        with pytest.raises(BulkWriteError):
+            collection.insert_many([{"name": "Foo"}, {"name": "Foo"}])
+
+    # Test Case: Creating the same index twice, then the same name with different options.
+    def test_create_twice(self, collection):
+        assert collection.create_index("name") == collection.create_index("name")
+        with pytest.raises(OperationFailure):
+            collection.create_index("name", unique=True)
+
+
+class TestBulkWrite:
+    @pytest.fixture
+    def requests(self):
+        return [InsertOne({"_id": 1}), InsertOne({"_id": 1}), InsertOne({"_id": 2}), DeleteOne({"_id": 1})]
+
+    # Test Case: An ordered bulk write stops at the first error.
+    def test_ordered(self, collection, requests):
+        with pytest.raises(BulkWriteError) as error:
+            collection.bulk_write(requests)
+        details = error.value.details
+        assert details["nInserted"] == 1
+        assert [write_error["index"] for write_error in details["writeErrors"]] == [1]
+        assert details["writeErrors"][0]["code"] == 11000
+        assert [doc["_id"] for doc in collection.find()] == [1]
+
+    # Test Case: An unordered bulk write keeps going after an error.
+    def test_unordered(self, collection, requests):
+        with pytest.raises(BulkWriteError) as error:
+            collection.bulk_write(requests, ordered=False)
+        details = error.value.details
+        assert details["nInserted"] == 2
+        assert details["nRemoved"] == 1
+        assert [write_error["index"] for write_error in details["writeErrors"]] == [1]
+        assert [doc["_id"] for doc in collection.find()] == [2]
+
+    # Test Case: Counting matched, modified, and upserted documents.
+    def test_counts(self, collection):
+        collection.insert_many([{"_id": 1, "n": 0}, {"_id": 2, "n": 0}])
+        result = collection.bulk_write([
+            UpdateOne({"_id": 1}, {"$set": {"n": 1}}),
+            UpdateOne({"_id": 2}, {"$set": {"n": 0}}),
+            UpdateOne({"_id": 3}, {"$set": {"n": 1}}, upsert=True)
+        ])
+        assert result.matched_count == 2
+        assert result.modified_count == 1
+        assert result.upserted_ids == {2: 3}
+
+
+class TestAggregate:
+    @pytest.fixture
+    def docs(self, database):
+        database.Audio.insert_many([
+            {"_id": "a", "userId": "u1", "wer": 0.2},
+            {"_id": "b", "userId": "u1", "wer": 0.4},
+            {"_id": "c", "userId": "u2", "wer": 0.1}
+        ])
+        database.RecordedQuestions.insert_many([
+            {"_id": 1, "category": "history", "recordings": [{"id": "a"}, {"id": "c"}]},
+            {"_id": 2, "category": "science", "recordings": [{"id": "b"}]}
+        ])
+
+    # Test Case: Grouping and sorting.
+    def test_group(self, database, docs):
+        results = list(database.Audio.aggregate([
+            {"$group": {"_id": "$userId", "count": {"$sum": 1}, "avgWer": {"$avg": "$wer"}, "ids": {"$push": "$_id"}}},
+            {"$sort": {"count": -1}}
+        ]))
+        assert results[0] == {"_id": "u1", "count": 2, "avgWer": pytest.approx(0.3), "ids": ["a", "b"]}
+        assert results[1]["_id"] == "u2"
+
+    # Test Case: Unwinding an array, joining another collection, and reshaping the results.
+    def test_unwind_lookup(self, database, docs):
+        results = list(database.RecordedQuestions.aggregate([
+            {"$match": {"category": "history"}},
+            {"$unwind": "$recordings"},
+            {"$lookup": {"from": "Audio", "localField": "recordings.id", "foreignField": "_id", "as": "audio"}},
+            {"$project": {"_id": 0, "id": "$recordings.id", "wer": {"$first": "$audio.wer"}}},
+            {"$sort": {"wer": 1}}
+        ]))
+        assert results == [{"id": "c", "wer": 0.1}, {"id": "a", "wer": 0.2}]
+
+    # Test Case: Counting, skipping, limiting, and sampling.
+    def test_count_limit_sample(self, database, docs):
+        assert list(database.Audio.aggregate([{"$match": {"wer": {"$gt": 0.15}}}, {"$count": "n"}])) == [{"n": 2}]
+        assert [doc["_id"] for doc in database.Audio.aggregate([{"$skip": 1}, {"$limit": 1}])] == ["b"]
+        assert len(list(database.Audio.aggregate([{"$sample": {"size": 5}}]))) == 3
+
+    # Test Case: A stage that MongoDB does not have.
+    def test_unknown_stage(self, database, docs):
+        with pytest.raises(OperationFailure):
+            list(database.Audio.aggregate([{"$foo": {}}]))
+
+
+class TestTransaction:
+    @pytest.fixture
+    def session(self, database):
+        with database.client.start_session() as session:
+            yield session
+
+    @pytest.fixture
+    def docs(self, collection):
+        collection.insert_many([{"_id": 1, "n": 1}, {"_id": 2, "n": 2}, {"_id": 3, "n": 3}])
+
+    def apply_writes(self, collection, session):
+        collection.insert_one({"_id": 4, "n": 4}, session=session)
+        collection.update_one({"_id": 1}, {"$inc": {"n": 10}}, session=session)
+        collection.update_one({"_id": 1}, {"$inc": {"n": 10}}, session=session)
+        collection.delete_one({"_id": 2}, session=session)
+        collection.bulk_write([UpdateOne({"_id": 3}, {"$set": {"n": 0}}), InsertOne({"_id": 5})], session=session)
+
+    # Test Case: Committing keeps every write of the transaction.
+    def test_commit(self, collection, session, docs):
+        with session.start_transaction():
+            self.apply_writes(collection, session)
+        assert list(collection.find()) == [{"_id": 1, "n": 21}, {"_id": 3, "n": 0}, {"_id": 4, "n": 4}, {"_id": 5}]
+
+    # Test Case: Aborting undoes every write of the transaction, including several writes to the same document.
+    def test_abort(self, collection, session, docs):
+        session.start_transaction()
+        self.apply_writes(collection, session)
+        session.abort_transaction()
+        assert sorted(collection.find(), key=lambda doc: doc["_id"]) \
+            == [{"_id": 1, "n": 1}, {"_id": 2, "n": 2}, {"_id": 3, "n": 3}]
+
+    # Test Case: An error inside the transaction block aborts the transaction and is raised again.
+    def test_abort_on_error(self, collection, session, docs):
+        with pytest.raises(DuplicateKeyError):
+            with session.start_transaction():
+                collection.update_one({"_id": 1}, {"$set": {"n": 0}}, session=session)
+                collection.insert_one({"_id": 2}, session=session)
+        assert not session.in_transaction
+        assert collection.find_one({"_id": 1})["n"] == 1
+
+    # Test Case: Writes made without the session while the transaction is in progress survive the abort, including a
+    # write to a document that the transaction also wrote.
+    def test_abort_keeps_outside_writes(self, collection, session, docs):
+        session.start_transaction()
+        collection.update_one({"_id": 1}, {"$set": {"n": 0}}, session=session)
+        collection.update_one({"_id": 1}, {"$set": {"outside": True}})
+        collection.update_one({"_id": 2}, {"$set": {"n": 20}})
+        collection.insert_one({"_id": 6})
+        session.abort_transaction()
+        assert collection.find_one({"_id": 1}) == {"_id": 1, "n": 0, "outside": True}
+        assert collection.find_one({"_id": 2}) == {"_id": 2, "n": 20}
+        assert collection.find_one({"_id": 6}) == {"_id": 6}
+
+    # Test Case: Aborting drops the collections and indexes that the transaction created, along with the unique
+    # constraints of those indexes.
+    def test_abort_created(self, database, collection, session, docs):
+        session.start_transaction()
+        database.Votes.insert_one({"userId": "u", "audioId": "a"}, session=session)
+        collection.create_index("n", unique=True, session=session)
+        session.abort_transaction()
+        assert "Votes" not in database.list_collection_names()
+        assert "n_1" not in collection.index_information()
+        collection.insert_one({"_id": 7, "n": 1})
+
+    # Test Case: Dropping an index is not allowed in a transaction.
+    def test_drop_index(self, collection, session):
+        collection.create_index("n")
+        with pytest.raises(OperationFailure):
+            with session.start_transaction():
+                collection.drop_index("n_1", session=session)
+        assert "n_1" in collection.index_information()
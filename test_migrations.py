@@ -0,0 +1,104 @@
+import pytest
+
+import indexes
+import migrations
+import testutil
+
+# For testing the data migrations in migrations.py against the configured database backend. The migrations rely on the
+# unique constraints of the indexes in indexes.py, so the fixtures create the indexes that each migration needs. The
+# test database is shared, so only the documents of the fixtures are checked.
+
+
+@pytest.mark.usefixtures("mongodb")
+class TestMoveRecordedAudios:
+    NUM_USERS = 5
+    NUM_RECORDINGS = 3
+
+    @pytest.fixture
+    def users(self, mongodb):
+        mongodb.UserRecordings.create_indexes(indexes.INDEXES["UserRecordings"])
+        user_docs = []
+        for _ in range(self.NUM_USERS):
+            user_docs.append({
+                "_id": testutil.generate_uid(),
+                "recordedAudios": [
+                    {"id": testutil.generate_audio_id(), "recType": "normal"} for _ in range(self.NUM_RECORDINGS)
+                ]
+            })
+        user_docs.append({"_id": testutil.generate_uid(), "recordedAudios": []})
+        mongodb.Users.insert_many(user_docs)
+        yield user_docs
+        user_ids = [user["_id"] for user in user_docs]
+        mongodb.Users.delete_many({"_id": {"$in": user_ids}})
+        mongodb.UserRecordings.delete_many({"userId": {"$in": user_ids}})
+
+    @staticmethod
+    def fixture_query(users):
+        return {"_id": {"$in": [user["_id"] for user in users]}}
+
+    def check_migrated(self, mongodb, users):
+        for user in users:
+            user_doc = mongodb.Users.find_one({"_id": user["_id"]})
+            assert "recordedAudios" not in user_doc
+            recordings = mongodb.UserRecordings.find({"userId": user["_id"]}, {"_id": 0, "id": 1, "recType": 1})
+            assert sorted(recordings, key=lambda rec: rec["id"]) \
+                == sorted(user["recordedAudios"], key=lambda rec: rec["id"])
+
+    # Test Case: Migrating users in batches smaller than the number of users.
+    def test_move(self, mongodb, users):
+        migrations.move_recorded_audios(mongodb, batch_size=2, query=self.fixture_query(users))
+        self.check_migrated(mongodb, users)
+
+    # Test Case: Running the migration again, and resuming one that stopped after copying some recordings.
+    def test_rerun(self, mongodb, users):
+        mongodb.UserRecordings.insert_one({
+            "userId": users[0]["_id"],
+            "id": users[0]["recordedAudios"][0]["id"],
+            "recType": "normal"
+        })
+        migrations.move_recorded_audios(mongodb, query=self.fixture_query(users))
+        self.check_migrated(mongodb, users)
+        migrations.move_recorded_audios(mongodb, query=self.fixture_query(users))
+        self.check_migrated(mongodb, users)
+
+    # Test Case: The server adds a recording after the migration has read the user. The new recording should stay in
+    # the array instead of being lost, and the next run should move it.
+    def test_concurrent_push(self, mongodb, users):
+        user = users[0]
+        snapshot = mongodb.Users.find_one({"_id": user["_id"]}, {"_id": 1, "recordedAudios": 1})
+        new_recording = {"id": testutil.generate_audio_id(), "recType": "buzz"}
+        mongodb.Users.update_one({"_id": user["_id"]}, {"$push": {"recordedAudios": new_recording}})
+        migrations._move_batch(mongodb, [snapshot])
+        assert mongodb.Users.find_one({"_id": user["_id"]})["recordedAudios"] == [new_recording]
+
+        user["recordedAudios"].append(new_recording)
+        migrations.move_recorded_audios(mongodb, query=self.fixture_query(users))
+        self.check_migrated(mongodb, users)
+
+
+@pytest.mark.usefixtures("mongodb")
+class TestBucketDifficulties:
+    DIFFICULTY_LIMITS = [3, 6, None]
+
+    @pytest.fixture
+    def questions(self, mongodb):
+        question_docs = [{"transcript": "Foo", "recDifficulty": d} for d in range(10)]
+        question_docs.append({"transcript": "Foo"})
+        results = mongodb.UnrecordedQuestions.insert_many(question_docs)
+        yield results.inserted_ids
+        mongodb.UnrecordedQuestions.delete_many({"_id": {"$in": results.inserted_ids}})
+
+    # Test Case: Bucketing the questions, then bucketing them again with other limits. Each question with a difficulty
+    # should end up in the bucket for the latest limits, and a question without one should be left alone.
+    def test_bucket(self, mongodb, questions):
+        query = {"_id": {"$in": questions}}
+        new_limits = [limit + 1 if limit is not None else None for limit in self.DIFFICULTY_LIMITS]
+        for difficulty_limits in [self.DIFFICULTY_LIMITS, new_limits]:
+            migrations.bucket_difficulties(mongodb, difficulty_limits, query)
+            for question in mongodb.UnrecordedQuestions.find(query):
+                if "recDifficulty" in question:
+                    expected_type = testutil.get_difficulty_type(question["recDifficulty"], difficulty_limits)
+                    assert question["difficultyType"] == expected_type
+                else:
+                    assert "difficultyType" not in question
+        assert migrations.bucket_difficulties(mongodb, new_limits, query) == 0
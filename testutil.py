@@ -1,9 +1,24 @@
+import gzip
+import json
+import os
 import random
 import string
 from http import HTTPStatus
 from secrets import token_urlsafe
 from typing import Union
 
+import pytest
+from openapi_schema_validator import OAS30Validator
+from pymongo import monitoring
+from werkzeug.exceptions import HTTPException
+
+# "pymongo" connects to the database at CONNECTION_STRING. "memory" keeps the database in-process (see memorydb.py).
+MONGODB_BACKEND = os.environ.get("MONGODB_BACKEND", "pymongo")
+# "firebase" stores blobs in the Firebase bucket. "local" stores them under the test storage root (see blobstorage.py).
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "firebase")
+# Number of processes the server uses to pre-screen the files of a segmented upload concurrently.
+PRESCREEN_WORKERS = int(os.environ.get("PRESCREEN_WORKERS", os.cpu_count() or 1))
+
 
 def generate_audio_id(nbytes=32):
     return token_urlsafe(nbytes)
@@ -15,3 +30,143 @@ def generate_uid(length=32):
 
 def match_status(expected: Union[int, HTTPStatus], actual: Union[str, int, HTTPStatus]):
     return expected == actual or str(int(expected)) in actual
+
+
+def has_route(app, path, method="GET"):
+    """Check if the server has a route for a request."""
+    try:
+        app.url_map.bind("localhost").match(path, method)
+    except HTTPException:
+        return False
+    return True
+
+
+def require_route(app, path, method="GET"):
+    """Skip the calling test if the server does not have a route yet, for tests of features it may not implement."""
+    if not has_route(app, path, method):
+        pytest.skip(f"The server has no route for {method} {path}")
+
+
+def get_difficulty_type(rec_difficulty, difficulty_limits):
+    """Get the index of the difficulty bucket of a question. Each limit is the exclusive upper bound of a bucket."""
+    for i, limit in enumerate(difficulty_limits):
+        if limit is None or rec_difficulty < limit:
+            return i
+    return None
+
+
+def get_plan_stages(explain_output):
+    """Get the names of every stage in the winning plan from the output of explain()."""
+    if "queryPlanner" not in explain_output:
+        # Aggregations that are not pushed down to the query layer entirely report the plan of their first stage.
+        explain_output = explain_output["stages"][0]["$cursor"]
+    winning_plan = explain_output["queryPlanner"]["winningPlan"]
+    plans = [winning_plan.get("queryPlan", winning_plan)]
+    stages = []
+    while plans:
+        plan = plans.pop()
+        stages.append(plan["stage"])
+        if "inputStage" in plan:
+            plans.append(plan["inputStage"])
+        plans += plan.get("inputStages", [])
+    return stages
+
+
+def explain_command(database, command):
+    """Explain a command that was sent to the database, without the fields that the driver or a transaction added."""
+    driver_fields = ["lsid", "txnNumber", "readConcern", "writeConcern", "startTransaction", "autocommit"]
+    command = {k: v for k, v in command.items() if not k.startswith("$") and k not in driver_fields}
+    return database.command("explain", command)
+
+
+def get_cache_stats(client, cache_name):
+    """Get the hits, misses, size, and maximum size of one of the server's in-process caches."""
+    response = client.get("/stats/cache")
+    assert response.status_code == HTTPStatus.OK
+    return response.get_json()[cache_name]
+
+
+def get_json_body(response):
+    """Decompress the body of a response according to its Content-Encoding and parse it as JSON."""
+    encoding = response.headers.get("Content-Encoding", "identity")
+    data = response.get_data()
+    if encoding == "gzip":
+        data = gzip.decompress(data)
+    elif encoding == "br":
+        import brotli  # Optional, since only servers with brotli installed send it.
+        data = brotli.decompress(data)
+    elif encoding != "identity":
+        raise ValueError(f"Unsupported Content-Encoding: '{encoding}'")
+    return json.loads(data)
+
+
+class ValidatorRegistry:
+    """
+    Compiled validators for the schemas of an API specification. Each schema is resolved and compiled on first use, then
+    reused, instead of on every call as with openapi_schema_validator.validate().
+    """
+
+    def __init__(self, api_spec):
+        self.api_spec = api_spec
+        self._validators = {}
+
+    def for_response(self, operation_id, status=HTTPStatus.OK, content_type="application/json"):
+        """Get the validator of the response body of an operation."""
+        key = ("response", operation_id, int(status), content_type)
+        if key not in self._validators:
+            path, method = self.api_spec.path_for(operation_id)
+            op_content = self.api_spec.api["paths"][path][method]
+            schema = op_content["responses"][str(int(status))]["content"][content_type]["schema"]
+            self._validators[key] = self._compile(self.api_spec.build_schema(schema))
+        return self._validators[key]
+
+    def for_schema(self, schema_name):
+        """Get the validator of a schema in the components of the specification."""
+        key = ("schema", schema_name)
+        if key not in self._validators:
+            self._validators[key] = self._compile(self.api_spec.get_schema(schema_name, resolve_references=True))
+        return self._validators[key]
+
+    @staticmethod
+    def _compile(schema):
+        OAS30Validator.check_schema(schema)
+        return OAS30Validator(schema)
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """A listener that keeps the commands that a MongoDB client sends, so that tests can see the server's queries."""
+
+    # Commands with a query filter, and the field that holds the statements of those that can have more than one.
+    QUERY_COMMANDS = {"find": None, "aggregate": None, "findAndModify": None, "update": "updates", "delete": "deletes"}
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def clear(self):
+        self.commands.clear()
+
+    def queries(self, collection_name=None):
+        """
+        Get the commands with a query filter that were sent, optionally only those for one collection. Each statement of
+        an update or delete command becomes a command of its own, since explain() takes one statement at a time.
+        """
+        queries = []
+        for command in self.commands:
+            command_name, target = next(iter(command.items()))
+            if command_name not in self.QUERY_COMMANDS or collection_name not in [None, target]:
+                continue
+            statements_field = self.QUERY_COMMANDS[command_name]
+            if statements_field is None:
+                queries.append(command)
+            else:
+                queries += [{**command, statements_field: [statement]} for statement in command[statements_field]]
+        return queries